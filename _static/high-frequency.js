@@ -42,6 +42,9 @@ const maxaction = 1;
 const stepsize = 0.01; // used to draw the counterfactual payoff
 const numchoices = (maxaction - minaction) / stepsize + 1  
 const hide_partner_payoff = !(js_vars.joint_payoff_info || js_vars.relative_payoff_info) ? true:false;
+const server_scheduler = js_vars.period_scheduler === 'server';
+const animation_mseconds = 200; // chart animation, at most animation_share of the next period
+const animation_share = 0.1;
 
 const myChart = new Chart(ctx, {
     type: 'scatter',
@@ -117,7 +120,7 @@ const myChart = new Chart(ctx, {
     },
     options: {
         animation: {
-            duration: '200',
+            duration: animation_mseconds,
         },
         maintainAspectRatio: false,
         onClick: (e) => {
@@ -126,6 +129,13 @@ const myChart = new Chart(ctx, {
             dataX  = Math.max(dataX, 0);
             dataX  = Math.min(dataX, 1);
             output = dataX;
+            // with the server scheduler the server ends the period, so it needs the latest choice right away
+            if (server_scheduler) {
+                liveSend({
+                    'type': 'action',
+                    'action': dataX
+                });
+            }
             myChart.options.plugins.annotation.annotations.line1.xMin = dataX;
             myChart.options.plugins.annotation.annotations.line1.xMax = dataX;
             myChart.update();
@@ -199,11 +209,21 @@ function update_countdown(expected, interval, msecondsleft, currentperiod) {
     }
 }
 
+// the curves are written into payoff_curve (a new array if it is not given), reusing its coordinates,
+// so the chart keeps its arrays from period to period
+function setCoordinate(payoff_curve, i, x, y) {
+    if (i < payoff_curve.length) {
+        payoff_curve[i].x = x;
+        payoff_curve[i].y = y;
+    } else {
+        payoff_curve.push(new coordinate(x, y));
+    }
+}
+
 // function to draw payoff curve
-function payoffCurve(confidence, numchoices, otheraction, gamma) {
-    var payoff_curve = new Array();
+function payoffCurve(confidence, numchoices, otheraction, gamma, payoff_curve = new Array()) {
     for (let i = 0; i < numchoices; i++) {
-        payoff_curve.push(new coordinate(i/(numchoices-1), payoff(confidence, i/(numchoices-1), otheraction, gamma)));
+        setCoordinate(payoff_curve, i, i/(numchoices-1), payoff(confidence, i/(numchoices-1), otheraction, gamma));
     };
     return payoff_curve;
 }
@@ -215,28 +235,76 @@ function coordinateArray(x, y) {
     return output;
 }
 
-function jointPayoffCurve(confidence, otherconfidence, numchoices, otheraction, gamma) {
-    var payoff_curve = new Array();
+// move the single coordinate of a dataset, unless it is hidden
+function movePoint(index, x, y) {
+    var dataset = myChart.data.datasets[index];
+    if (!dataset.hidden) {
+        dataset.data[0].x = x;
+        dataset.data[0].y = y;
+    }
+}
+
+// recompute a curve of the chart in place, only if it is shown and its inputs changed since it was last computed
+// (a dataset that is shown again after it was hidden is recomputed as well)
+var curve_inputs = {};
+function updateCurve(index, curve, confidence, otherconfidence, otheraction) {
+    var dataset = myChart.data.datasets[index];
+    if (dataset.hidden) {
+        delete curve_inputs[index];
+        return;
+    }
+    var inputs = curve_inputs[index];
+    if (inputs && inputs[0] === confidence && inputs[1] === otherconfidence && inputs[2] === otheraction) {
+        return;
+    }
+    curve_inputs[index] = [confidence, otherconfidence, otheraction];
+    if (curve === payoffCurve) {
+        payoffCurve(confidence, numchoices, otheraction, js_vars.gamma, dataset.data);
+    } else {
+        curve(confidence, otherconfidence, numchoices, otheraction, js_vars.gamma, dataset.data);
+    }
+}
+
+function jointPayoffCurve(confidence, otherconfidence, numchoices, otheraction, gamma, payoff_curve = new Array()) {
     for (let i = 0; i < numchoices; i++) {
         var jointpay = payoff(confidence, i/(numchoices-1), otheraction, gamma) + payoff(otherconfidence, otheraction, i/(numchoices-1), gamma);
-        payoff_curve.push(new coordinate(i/(numchoices-1), jointpay));
+        setCoordinate(payoff_curve, i, i/(numchoices-1), jointpay);
     };
     return payoff_curve;
 }
 
-function relativePayoffCurve(confidence, otherconfidence, numchoices, otheraction, gamma) {
-    var payoff_curve = new Array();
+function relativePayoffCurve(confidence, otherconfidence, numchoices, otheraction, gamma, payoff_curve = new Array()) {
     for (let i = 0; i < numchoices; i++) {
         var difference = -Math.abs(payoff(confidence, i/(numchoices-1), otheraction, gamma) - payoff(otherconfidence, otheraction, i/(numchoices-1), gamma));
         //var difference = payoff(otherconfidence, otheraction, i/(numchoices-1), gamma);
         //var difference = payoff(confidence, i/(numchoices-1), otheraction, gamma) - payoff(otherconfidence, otheraction, i/(numchoices-1), gamma);
-        payoff_curve.push(new coordinate(i/(numchoices-1), difference));
+        setCoordinate(payoff_curve, i, i/(numchoices-1), difference);
     };
     return payoff_curve;
 }
 
+// messages are arrays [version, sequence number, type, values of js_vars.message_fields] (see lab_protocol.py),
+// turn them into an object with named fields
+var last_seq = 0;
+function decodeMessage(message) {
+    if (message[0] !== js_vars.live_protocol) {
+        console.log('unknown live protocol version', message[0]);
+    }
+    var data = {version: message[0], seq: message[1], type: js_vars.message_types[message[2]]};
+    for (let i = 0; i < js_vars.message_fields.length; i++) {
+        data[js_vars.message_fields[i]] = message[i + 3];
+    }
+    // a resync after a reload repeats the last number, only a jump ahead means a message was missed
+    if (data.seq > last_seq + 1 && last_seq !== 0) {
+        console.log('expected message', last_seq + 1, 'but received', data.seq);
+    }
+    last_seq = data.seq;
+    return data;
+}
+
 // function what to do when the server sends a message
-function liveRecv(data) {
+function liveRecv(message) {
+    var data = decodeMessage(message);
     console.log('received', data) // record it for debugging
     gamestate.innerHTML = '';
     millisecondsleft = data.next_period_length;
@@ -256,26 +324,29 @@ function liveRecv(data) {
         round_payoff = data.p2_round_payoff;
     }
 
-    // update chart
+    // update chart. the datasets keep their arrays, only shown datasets are updated and the curves are only
+    // recomputed when the partner's action or a confidence changed
     // own payoff curve
-    myChart.data.datasets[0].data = payoffCurve(js_vars.confidence, numchoices, partner_action, js_vars.gamma);
+    updateCurve(0, payoffCurve, js_vars.confidence, null, partner_action);
     // own action
-    myChart.data.datasets[1].data = coordinateArray(action, 0);
+    movePoint(1, action, 0);
     // partner's action
-    myChart.data.datasets[2].data = coordinateArray(partner_action, 0);
+    movePoint(2, partner_action, 0);
     // own payoff
-    myChart.data.datasets[3].data = coordinateArray(action, period_payoff);
+    movePoint(3, action, period_payoff);
     // partner's payoff
-    myChart.data.datasets[4].data = coordinateArray(partner_action, partner_period_payoff);
+    movePoint(4, partner_action, partner_period_payoff);
     // joint payoff
-    myChart.data.datasets[5].data = coordinateArray(action, period_payoff+partner_period_payoff);
+    movePoint(5, action, period_payoff+partner_period_payoff);
     // joint payoff bubble
-    myChart.data.datasets[6].data = jointPayoffCurve(js_vars.confidence, js_vars.partner_confidence, numchoices, partner_action, js_vars.gamma);
+    updateCurve(6, jointPayoffCurve, js_vars.confidence, js_vars.partner_confidence, partner_action);
     // payoff difference
-    myChart.data.datasets[7].data = coordinateArray(action, period_payoff - partner_period_payoff);
+    movePoint(7, action, period_payoff - partner_period_payoff);
     // payoff difference bubble
-    myChart.data.datasets[8].data = relativePayoffCurve(js_vars.confidence, js_vars.partner_confidence, numchoices, partner_action, js_vars.gamma);
+    updateCurve(8, relativePayoffCurve, js_vars.confidence, js_vars.partner_confidence, partner_action);
 
+    // the redraw runs on the thread of the period timers, keep its animation within a share of the period
+    myChart.options.animation.duration = Math.min(animation_mseconds, animation_share * data.next_period_length);
     myChart.update();
 
     if (data.period == 0) {
@@ -296,7 +367,10 @@ function liveRecv(data) {
         countdown.innerHTML = 'Nächste Periode in ' + Math.round(data.next_period_length/1000) + ' Sekunden';
 
         setTimeout(function() {update_countdown(next_countdown_expected, interval, data.next_period_length)}, interval);
-        setTimeout(function() {send_update(action = parseFloat(output), data.expected)}, data.next_period_length);
+        // the client ends the period: reply with state of the game after the specified amount of time
+        if (!server_scheduler) {
+            setTimeout(function() {send_update(action = parseFloat(output), data.expected)}, data.next_period_length);
+        }
     }
     else if (data.type === 'end-supergame') {
         gamestate.innerHTML = 'Ende des Spiels';
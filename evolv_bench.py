@@ -0,0 +1,98 @@
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import evolv_simu
+
+
+# representative shapes, every case is run for each choice function and evolution mechanism
+SHAPES = dict(
+    m=dict(small=50, large=5000),
+    n=dict(two=2, eight=8),
+    t=dict(short=150, long=2000),
+)
+QUICK_SHAPES = dict(
+    m=dict(small=20, large=500),
+    n=dict(two=2, eight=8),
+    t=dict(short=50, long=300),
+)
+CHOICE_FUNCS = ('best_choice_slow', 'best_choice_wrong', 'mimic_choice', 'always_half')
+EVO_MECHS = ('best', 'weighted_average')
+
+
+def bench_cases(shapes=SHAPES, choice_funcs=CHOICE_FUNCS, evo_mechs=EVO_MECHS):
+    for m, n, t, choice_func, evo_mech in itertools.product(
+            shapes['m'].values(), shapes['n'].values(), shapes['t'].values(), choice_funcs, evo_mechs):
+        yield dict(m=m, n=n, t=t, choice_func=choice_func, evo_mech=evo_mech)
+
+
+# times run_simulation for one case, the best of repeat runs is reported.
+# peak memory is the largest traced allocation (python and numpy) during construction and run
+def bench_case(case, repeat=1, seed=0):
+    parameters = {name: getattr(evolv_simu.Simulation, name) for name in evolv_simu.PARAMETER_NAMES}
+    parameters.update(case, choice_func=getattr(evolv_simu, case['choice_func']), seed=seed)
+    seconds = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        simulation = evolv_simu.Simulation(parameters)
+        start = time.perf_counter()
+        simulation.run_simulation()
+        seconds.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del simulation
+    player_ticks = case['m'] * case['n'] * (case['t'] - 1)
+    return dict(
+        case,
+        seconds=min(seconds),
+        player_ticks=player_ticks,
+        player_ticks_per_second=player_ticks / min(seconds),
+        peak_memory_bytes=peak,
+    )
+
+
+# where and on what the benchmark ran, so results of different runs can be compared
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return dict(
+        commit=commit,
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        machine=platform.machine(),
+        processor=platform.processor(),
+    )
+
+
+# python evolv_bench.py --quick --output bench.jsonl
+# writes one json line per case, every line carries the environment so files of different runs can be concatenated
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark evolv_simu.Simulation.run_simulation')
+    parser.add_argument('--quick', action='store_true', help='smaller shapes for a fast check')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--choice-func', nargs='*', default=CHOICE_FUNCS)
+    parser.add_argument('--evo-mech', nargs='*', default=EVO_MECHS)
+    parser.add_argument('--output', help='append the results to this file instead of printing them')
+    args = parser.parse_args()
+
+    env = environment()
+    output = open(args.output, 'a') if args.output else sys.stdout
+    for case in bench_cases(QUICK_SHAPES if args.quick else SHAPES, args.choice_func, args.evo_mech):
+        result = dict(bench_case(case, args.repeat), **env)
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+        print(f'{case} {result["player_ticks_per_second"]:.3g} player-ticks/s, '
+              f'{result["peak_memory_bytes"] / 2**20:.1f} MiB', file=sys.stderr)
+    if args.output:
+        output.close()
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+# best replies for the manager payoff of the linear demand market
+#   payoff(x) = mean over others k of c * max(0, x * (a - x - gamma * q_k))
+# a has shape (...), other_qs has shape (..., k), the result has shape (...).
+# decimal_places chooses the action grid: 2 is the grid the simulation always used (0, 0.01, ..., 1),
+# 3 is the grid of the lab app (evolving_managers C.ACTION_DECIMAL_PLACES).
+
+
+def manager_payoff(gamma, c, a, x, other_qs):
+    a = np.asarray(a)[..., None]
+    x = np.asarray(x)[..., None]
+    pay = c * np.maximum(0, x * (a - x - gamma * np.asarray(other_qs)))
+    return pay.mean(axis=-1)
+
+
+# payoff of every grid point for all players at once, shape (..., 10**decimal_places + 1)
+def grid_payoffs(gamma, c, a, other_qs, decimal_places=2):
+    grid = action_grid(decimal_places)
+    a = np.asarray(a)[..., None]
+    other_qs = np.asarray(other_qs)
+    payoffs = np.zeros(a.shape[:-1] + grid.shape)
+    # loop over the (few) other players instead of building a (..., k, grid) block
+    for k in range(other_qs.shape[-1]):
+        payoffs += np.maximum(0, grid * (a - grid - gamma * other_qs[..., k, None]))
+    return c * payoffs / other_qs.shape[-1]
+
+
+# first grid point with the highest payoff, exactly what a scan over the grid returns
+def grid_best_reply(gamma, c, a, other_qs, decimal_places=2):
+    grid = action_grid(decimal_places)
+    return grid[grid_payoffs(gamma, c, a, other_qs, decimal_places).argmax(axis=-1)]
+
+
+def action_grid(decimal_places):
+    steps = 10**decimal_places
+    return np.arange(steps + 1) / steps
+
+
+# the payoff is a sum of concave parabolas x * (b_k - x) that are cut off at their root b_k = a - gamma * q_k.
+# between two neighbouring roots the set of active parabolas is fixed, so the payoff is concave there
+# and its maximum is either the vertex sum(b)/(2s) of the s active parabolas or an end of the interval.
+# the best reply is the best of these candidates, without decimal_places it is the exact maximizer on [0, 1].
+def best_reply(gamma, c, a, other_qs, decimal_places=None):
+    a = np.asarray(a, dtype=float)
+    roots = a[..., None] - gamma * np.asarray(other_qs)
+    roots = -np.sort(-roots, axis=-1)       # descending, the s largest roots are active on the s-th interval
+    num_active = np.arange(1, roots.shape[-1] + 1)
+    upper = roots
+    lower = np.concatenate([roots[..., 1:], np.full(roots.shape[:-1] + (1,), -np.inf)], axis=-1)
+    vertex = np.cumsum(roots, axis=-1) / (2 * num_active)
+    candidates = np.clip(np.clip(vertex, lower, upper), 0, 1)
+    if decimal_places is not None:
+        steps = 10**decimal_places
+        candidates = np.concatenate([np.floor(candidates * steps), np.ceil(candidates * steps)], axis=-1) / steps
+    candidates = np.concatenate([np.zeros(candidates.shape[:-1] + (1,)), candidates], axis=-1)
+    candidates = np.sort(candidates, axis=-1)     # ties go to the smallest action, like the grid scan
+    payoffs = manager_payoff(gamma, c, a[..., None], candidates, np.asarray(other_qs)[..., None, :])
+    best = payoffs.argmax(axis=-1)
+    return np.take_along_axis(candidates, best[..., None], axis=-1)[..., 0]
@@ -0,0 +1,139 @@
+import numpy as np
+
+from evolv_stats import QUANTILES, TickStats, tick_stats
+
+
+SERIES = ('q_history', 'a_history', 'p_manager_history', 'p_firm_history')
+# recording policies of the simulation, see make_history
+RECORDINGS = ('full', 'last', 'every', 'aggregates')
+
+
+# history of all players in all markets, preallocated for all t ticks in one shared block.
+# the block is tick major (series, ticks, markets, players), so recording a tick writes one contiguous slice.
+# series() returns views of shape (markets, players, ticks) that only cover the ticks recorded so far.
+class History:
+    def __init__(self, m, n, t, dtype=np.float64):
+        self.m = m
+        self.n = n
+        self.t = t
+        self.block = np.zeros((len(SERIES), t, m, n), dtype=dtype)
+        self.filled = 0
+
+    def record(self, tick, q, a, p_manager, p_firm):
+        self.write(tick, q, a, p_manager, p_firm)
+        self.filled = tick + 1
+
+    def write(self, slot, q, a, p_manager, p_firm):
+        block = self.block
+        block[0, slot] = q
+        block[1, slot] = a
+        block[2, slot] = p_manager
+        block[3, slot] = p_firm
+
+    # called when the simulation has finished
+    def close(self):
+        pass
+
+    # round numbers (starting at 1) of the ticks returned by series()
+    @property
+    def ticks(self):
+        return np.arange(1, self.filled + 1)
+
+    def series(self, name):
+        return self.block[SERIES.index(name), :self.filled].transpose(1, 2, 0)
+
+    # per tick statistics over markets, see evolv_stats
+    def stats(self, name, quantile_levels=QUANTILES):
+        market_means = self.series(name).mean(axis=1)
+        return tick_stats(market_means, self.ticks, quantile_levels)
+
+
+# keeps only the last k ticks in a ring buffer
+class RingHistory(History):
+    def __init__(self, m, n, t, k, dtype=np.float64):
+        super().__init__(m, n, min(k, t), dtype)
+        self.k = min(k, t)
+        self.t = t
+
+    def record(self, tick, q, a, p_manager, p_firm):
+        self.write(tick % self.k, q, a, p_manager, p_firm)
+        self.filled = tick + 1
+
+    @property
+    def ticks(self):
+        return np.arange(max(0, self.filled - self.k), self.filled) + 1
+
+    # the ticks in the buffer in chronological order (a copy once the buffer has wrapped around)
+    def series(self, name):
+        block = self.block[SERIES.index(name)]
+        if self.filled <= self.k:
+            return block[:self.filled].transpose(1, 2, 0)
+        start = self.filled % self.k
+        return np.concatenate([block[start:], block[:start]]).transpose(1, 2, 0)
+
+
+# keeps every k-th tick, starting with the first
+class StrideHistory(History):
+    def __init__(self, m, n, t, k, dtype=np.float64):
+        super().__init__(m, n, -(-t // k), dtype)
+        self.k = k
+        self.t = t
+
+    def record(self, tick, q, a, p_manager, p_firm):
+        if tick % self.k == 0:
+            self.write(tick // self.k, q, a, p_manager, p_firm)
+        self.filled = tick + 1
+
+    @property
+    def ticks(self):
+        return np.arange(0, self.filled, self.k) + 1
+
+    def series(self, name):
+        return self.block[SERIES.index(name), :len(self.ticks)].transpose(1, 2, 0)
+
+
+# keeps no player histories, only the per tick statistics over markets of every series
+class AggregateHistory(History):
+    def __init__(self, m, n, t, quantile_levels=QUANTILES):
+        self.m = m
+        self.n = n
+        self.t = t
+        self.quantile_levels = tuple(quantile_levels)
+        # per series: mean, variance, min, max and the quantiles of the market averages, shape (series, statistics, ticks)
+        self.block = np.zeros((len(SERIES), 4 + len(self.quantile_levels), t))
+        self.filled = 0
+
+    def write(self, slot, q, a, p_manager, p_firm):
+        market_means = np.stack([q, a, p_manager, p_firm]).mean(axis=2)
+        block = self.block
+        block[:, 0, slot] = market_means.mean(axis=1)
+        block[:, 1, slot] = market_means.var(axis=1, ddof=1)
+        block[:, 2, slot] = market_means.min(axis=1)
+        block[:, 3, slot] = market_means.max(axis=1)
+        block[:, 4:, slot] = np.quantile(market_means, self.quantile_levels, axis=1).T
+
+    def series(self, name):
+        raise ValueError('only aggregates are recorded, player histories are not available')
+
+    def stats(self, name, quantile_levels=QUANTILES):
+        if tuple(quantile_levels) != self.quantile_levels:
+            raise ValueError('only the quantiles ' + repr(self.quantile_levels) + ' are recorded')
+        block = self.block[SERIES.index(name), :, :self.filled]
+        return TickStats(self.ticks, block[0], block[1], block[2], block[3], self.quantile_levels, block[4:])
+
+
+# history for a recording policy:
+#   'full'        all ticks
+#   'last'        the last k ticks (ring buffer)
+#   'every'       every k-th tick
+#   'aggregates'  only per tick statistics over markets
+def make_history(recording, m, n, t, k=None, dtype=np.float64):
+    if recording == 'full':
+        return History(m, n, t, dtype)
+    elif recording == 'last':
+        return RingHistory(m, n, t, k, dtype)
+    elif recording == 'every':
+        return StrideHistory(m, n, t, k, dtype)
+    elif recording == 'aggregates':
+        return AggregateHistory(m, n, t)
+    raise ValueError('unknown recording ' + repr(recording) + ', options are ' + repr(RECORDINGS))
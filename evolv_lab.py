@@ -0,0 +1,178 @@
+import argparse
+import time
+
+import numpy as np
+
+from evolv_random import generator
+from lab_protocol import MAX_CONFIDENCE, MIN_CONFIDENCE, NOISE_RANGE, load_schedule
+
+
+# batch simulator of the evolution protocol of the lab app (evolving_managers) with managers that play
+# the Nash action in every period, like a session with session.config['simulation'] = True.
+# all sessions are simulated at once, arrays have shape (sessions, rounds, participants) with participants
+# ordered by id_in_session, so population p holds the participants (p-1)*population_size+1 .. p*population_size.
+
+def nash_action(confidence, partner_confidence, gamma):
+    return (2*confidence - gamma*partner_confidence)/(4 - gamma*gamma)
+
+
+# payoff_function of the app, 'payoff' and 'fitness'
+def period_payoff(action, confidence, partner_action, gamma):
+    return action * np.maximum(0, confidence - action - partner_action * gamma) * 100
+
+
+def period_fitness(action, partner_action, gamma):
+    return action * (1 - action - partner_action * gamma) * 100
+
+
+# random pairs within every population, returns the index of every participant's partner
+def match_pairs(rng, num_sessions, num_populations, population_size):
+    order = rng.random((num_sessions, num_populations, population_size)).argsort(axis=2)
+    offset = np.arange(num_populations)[None, :, None] * population_size
+    order = (order + offset).reshape(num_sessions, -1, 2)
+    partner = np.empty((num_sessions, num_populations * population_size), dtype=int)
+    sessions = np.arange(num_sessions)[:, None]
+    partner[sessions, order[:, :, 0]] = order[:, :, 1]
+    partner[sessions, order[:, :, 1]] = order[:, :, 0]
+    return partner
+
+
+# one step of update_confidence for arrays of shape (..., population_size):
+# the chance to select a manager rises linearly with the fitness rank (ties broken at random), a firm that selects
+# imitates a firm drawn with weights max(0, fitness - average fitness) (all equal if nobody is above average)
+# and adds uniform noise of width noise_range to the target's confidence, clamped to [min_confidence, max_confidence]
+def evolve(rng, confidence, fitness, noise_range=NOISE_RANGE, min_confidence=MIN_CONFIDENCE, max_confidence=MAX_CONFIDENCE):
+    size = fitness.shape[-1]
+    # rank 0 is the fittest firm, equal fitness is ordered by a random key
+    order = np.lexsort((rng.random(fitness.shape), -fitness), axis=-1)
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(size) + np.zeros_like(order), axis=-1)
+    prob_selection = rank / (size - 1)
+
+    weight = np.maximum(0, fitness - fitness.mean(axis=-1, keepdims=True))
+    weight = np.where((weight == 0).all(axis=-1, keepdims=True), 1, weight)
+    prob_imitation_target = weight / weight.sum(axis=-1, keepdims=True)
+
+    selected = rng.random(fitness.shape) <= prob_selection
+    cum_weights = np.cumsum(weight, axis=-1)
+    draw = rng.random(fitness.shape) * cum_weights[..., -1:]
+    imitation_target = np.minimum((cum_weights[..., None, :] <= draw[..., None]).sum(axis=-1), size - 1)
+    noise = rng.uniform(-noise_range/2, noise_range/2, fitness.shape)
+    imitated = np.clip(np.take_along_axis(confidence, imitation_target, axis=-1) + noise, min_confidence, max_confidence)
+    return dict(
+        rank=rank,
+        prob_selection=prob_selection,
+        weight=weight,
+        prob_imitation_target=prob_imitation_target,
+        selected=selected,
+        imitation_target=imitation_target,
+        next_confidence=np.where(selected, imitated, confidence),
+    )
+
+
+# results of simulate_sessions, every array has shape (sessions, rounds, participants)
+class LabRun:
+    def __init__(self, configs, num_sessions, num_participants, population_size, rounds):
+        self.configs = configs
+        self.num_sessions = num_sessions
+        self.num_participants = num_participants
+        self.population_size = population_size
+        self.num_rounds = rounds
+        shape = (num_sessions, rounds, num_participants)
+        self.population = np.arange(num_participants) // population_size + 1
+        self.confidence = np.zeros(shape)
+        self.initial_population_confidence = np.zeros(shape)
+        self.partner = np.zeros(shape, dtype=int)           # index (id_in_session - 1) of the partner
+        self.action = np.zeros(shape)
+        self.round_payoff = np.zeros(shape)
+        self.round_fitness = np.zeros(shape)
+        self.selected = np.zeros(shape, dtype=bool)
+        self.imitation_target = np.zeros(shape, dtype=int)  # id_in_session of the imitated firm
+        self.prob_selection = np.zeros(shape)
+
+    # points earned over all supergames, shape (sessions, participants)
+    @property
+    def total_payoff(self):
+        return self.round_payoff.sum(axis=1)
+
+    # average confidence of every population, shape (sessions, rounds, populations)
+    def population_confidence(self):
+        shape = self.confidence.shape[:2] + (-1, self.population_size)
+        return self.confidence.reshape(shape).mean(axis=3)
+
+
+# simulates num_sessions sessions of num_participants participants through all supergames of the treatment file
+def simulate_sessions(treatment_file, num_sessions=1000, num_participants=16, seed=None,
+                      noise_range=NOISE_RANGE, min_confidence=MIN_CONFIDENCE, max_confidence=MAX_CONFIDENCE):
+    schedule = load_schedule(treatment_file)
+    rng = generator(seed)
+    rounds = schedule.num_rounds
+    # populations are assigned in round 1 and kept for the whole session
+    population_size = schedule[1]['population_size']
+    if num_participants % population_size or population_size % 2:
+        raise ValueError('num_participants has to be a multiple of an even population_size')
+    num_populations = num_participants // population_size
+    run = LabRun(schedule.configs, num_sessions, num_participants, population_size, rounds)
+    shape = (num_sessions, num_participants)
+    sessions = np.arange(num_sessions)[:, None]
+
+    confidence = np.zeros(shape)
+    initial_population_confidence = np.zeros(shape)
+    for r in range(rounds):
+        round_number = r + 1
+        config = schedule[round_number]
+        gamma = config['gamma']
+
+        # creating_session: first supergame of a treatment, alternate the populations' initial confidence
+        if round_number == config['start_supergame']:
+            lower = run.population % 2 == config['treatment_id'] % 2
+            initial_population_confidence = np.where(lower, config['initial_confidence_lower'],
+                                                     config['initial_confidence_upper']) + np.zeros(shape)
+            confidence = initial_population_confidence + rng.uniform(-noise_range/2, noise_range/2, shape)
+        partner = match_pairs(rng, num_sessions, num_populations, population_size)
+
+        # SetupWaitPage with simulation: Nash actions, played in every period of the supergame
+        partner_confidence = confidence[sessions, partner]
+        action = nash_action(confidence, partner_confidence, gamma)
+        partner_action = action[sessions, partner]
+        round_payoff = config['num_periods'] * period_payoff(action, confidence, partner_action, gamma)
+        round_fitness = config['num_periods'] * period_fitness(action, partner_action, gamma)
+
+        # ResultsWaitPage: update_confidence within every population
+        evolution = evolve(rng,
+                           confidence.reshape(num_sessions, num_populations, population_size),
+                           round_fitness.reshape(num_sessions, num_populations, population_size),
+                           noise_range, min_confidence, max_confidence)
+        offset = np.arange(num_populations)[None, :, None] * population_size
+
+        run.confidence[:, r] = confidence
+        run.initial_population_confidence[:, r] = initial_population_confidence
+        run.partner[:, r] = partner
+        run.action[:, r] = action
+        run.round_payoff[:, r] = round_payoff
+        run.round_fitness[:, r] = round_fitness
+        run.selected[:, r] = evolution['selected'].reshape(shape)
+        run.imitation_target[:, r] = (evolution['imitation_target'] + offset).reshape(shape) + 1
+        run.prob_selection[:, r] = evolution['prob_selection'].reshape(shape)
+        # only carry the confidence over within a treatment
+        if round_number != config['end_supergame']:
+            confidence = evolution['next_confidence'].reshape(shape)
+    return run
+
+
+# python evolv_lab.py baseline.csv --sessions 5000 --participants 16
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='batch simulation of the evolving managers lab protocol')
+    parser.add_argument('treatment_file', help='file in evolving_managers/config or a path')
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--participants', type=int, default=16)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    start = time.time()
+    run = simulate_sessions(args.treatment_file, args.sessions, args.participants, args.seed)
+    print(f'{args.sessions} sessions x {run.num_rounds} supergames in {time.time() - start:.2f} s')
+    population_confidence = run.population_confidence()
+    for r in range(0, run.num_rounds, max(1, run.num_rounds // 10)):
+        print(f'supergame {r + 1}: mean confidence per population '
+              + ', '.join(f'{c:.3f}' for c in population_confidence[:, r].mean(axis=0)))
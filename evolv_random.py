@@ -0,0 +1,46 @@
+import numpy as np
+
+
+# seed sequence for a seed (None, an int or a SeedSequence) extended by a key, e.g. (cell, replication) or (market,).
+# the same seed and key always give the same stream, independent of the order in which streams are created
+def seed_sequence(seed, *key):
+    if isinstance(seed, np.random.SeedSequence):
+        return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + key, pool_size=seed.pool_size)
+    return np.random.SeedSequence(seed, spawn_key=key)
+
+
+def generator(seed, *key):
+    return np.random.Generator(np.random.PCG64(seed_sequence(seed, *key)))
+
+
+# markets of a chunk of a larger run share a generator, MARKET_BLOCK markets each (markets 0..255 use block 0 etc.)
+MARKET_BLOCK = 256
+
+
+# random streams of the markets with the part of the Generator interface the simulation uses.
+# the markets are split into blocks of MARKET_BLOCK markets with one generator each, and every draw takes a
+# full block from each generator, so the draws of a market only depend on the seed and the market's number: a
+# simulation of markets 0..9999 gives the same markets as ten simulations of 1000 markets each (with the same
+# MARKET_BLOCK). that is one vectorized draw per block instead of one per market.
+# markets is a range, size has to start with the number of markets.
+class MarketStreams:
+    def __init__(self, seed, markets, block=MARKET_BLOCK):
+        first_block = markets.start // block
+        last_block = (markets.stop - 1) // block
+        self.generators = [generator(seed, block, b) for b in range(first_block, last_block + 1)]
+        self.block = block
+        self.offset = markets.start - first_block * block
+        self.markets = len(markets)
+
+    def draw(self, method, size, *args):
+        rows = [getattr(g, method)(*args, size=(self.block,) + tuple(size[1:])) for g in self.generators]
+        return np.concatenate(rows)[self.offset:self.offset + self.markets]
+
+    def random(self, size):
+        return self.draw('random', size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return self.draw('uniform', size, low, high)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return self.draw('normal', size, loc, scale)
@@ -1,62 +1,16 @@
-import random
+import functools
 import numpy as np
-import matplotlib as mlp
 import matplotlib.pyplot as plt
-import operator
-import statistics
-
-
-# elements are weighted by weights
-def weighted_choice(elems, weights):
-    total = sum(weights)
-    rand = random.uniform(0, total)
-    cur_sum = 0
-    for i, w in enumerate(weights):
-        cur_sum += w
-        if rand < cur_sum:
-            return elems[i]
-    return elems[-1]
+from evolv_best_reply import best_reply, manager_payoff
+from evolv_history import SERIES, make_history
+from evolv_random import MarketStreams, generator, seed_sequence
+from evolv_store import MemmapHistory
 
 
+# plots the per tick statistics of a series, they are computed by the history (see evolv_stats)
 def show_stats(simulation, stat):  # options for stat: 'q_history', 'p_manager_history', 'p_firm_history', 'a_history'
-    x = [s + 1 for s in range(simulation.t)]
-    market_history = []
-    for i in range(simulation.m):
-        decision_average = [0 for s in range(simulation.t)]
-        for j in range(simulation.n):
-            if stat == 'q_history':
-                player_stat = simulation.markets[i][j].q_history
-            elif stat == 'p_manager_history':
-                player_stat = simulation.markets[i][j].p_manager_history
-            elif stat == 'p_firm_history':
-                player_stat = simulation.markets[i][j].p_firm_history
-            else:
-                player_stat = simulation.markets[i][j].a_history
-            decision_average = list(map(operator.add, decision_average, player_stat))
-        decision_average = [s * (1/simulation.n) for s in decision_average]
-        market_history = market_history + [decision_average]
-
-    market_average = []
-    lowest_market = []
-    highest_market = []
-    variance_history = []
-    for t in range(simulation.t):
-        lowest = market_history[0][t]
-        average = 0
-        highest = market_history[0][t]
-        variance_list = []
-        for i in range(len(market_history)):
-            average = average + market_history[i][t]
-            if lowest > market_history[i][t]:
-                lowest = market_history[i][t]
-            if highest < market_history[i][t]:
-                highest = market_history[i][t]
-            variance_list = variance_list + [market_history[i][t]]
-        average = average/len(market_history)
-        market_average = market_average + [average]
-        lowest_market = lowest_market + [lowest]
-        highest_market = highest_market + [highest]
-        variance_history = variance_history + [statistics.variance(variance_list)]
+    stats = simulation.history.stats(stat)
+    x = stats.ticks
 
     fig, (ax1, ax2) = plt.subplots(ncols=2, nrows=1, constrained_layout=False, num=None, figsize=(12, 6))
     if stat == 'q_history':
@@ -81,106 +35,111 @@ def show_stats(simulation, stat):  # options for stat: 'q_history', 'p_manager_h
         ax1.axis([1, simulation.t, 0, 2])
 
     ax1.set_xlabel('round')
-    ax1.plot(x, market_average, 'b-', label='average')
-    ax1.plot(x, lowest_market, 'r-', label='lowest')
-    ax1.plot(x, highest_market, 'g-', label='highest')
+    ax1.plot(x, stats.mean, 'b-', label='average')
+    ax1.plot(x, stats.min, 'r-', label='lowest')
+    ax1.plot(x, stats.max, 'g-', label='highest')
     ax1.legend()
 
     ax2.set_title("variance history")
     ax2.set_ylabel('variance')
     ax2.set_xlabel('round')
     ax2.set(xlim=(1, simulation.t))
-    ax2.plot(x, variance_history, 'b-', label='variance')
+    ax2.plot(x, stats.variance, 'b-', label='variance')
     ax2.legend()
 
     plt.show()
 
 
-def payoff_function_manager(gamma, c, a, q, other_qs):
-    payoff_sum = 0
-    for other_q in other_qs:
-        pay = c * q * (a - q - gamma * other_q)
-        payoff_sum += max(pay, 0)
-    payoff = payoff_sum/len(other_qs)
-    return payoff
+# q of the other players in the market for every player, shape (markets, players, players - 1)
+def other_qs(q):
+    n = q.shape[1]
+    others = np.array([[k for k in range(n) if k != j] for j in range(n)])
+    return q[:, others]
+
+
+# vectorized payoffs for all markets at once. q and a have shape (markets, players),
+# every player is matched against each other player in their market and the payoffs are averaged
+def market_payoff_manager(gamma, c, a, q):
+    return manager_payoff(gamma, c, a, q, other_qs(q))
+
+
+def market_payoff_firm(gamma, c, q):
+    return manager_payoff(gamma, c, 1, q, other_qs(q))
+
+
+# choice functions get the previous round of all markets as arrays of shape (markets, players)
+# and return the new (noise free) decisions in the same shape.
+# the grid choices take the action grid as decimal_places, use functools.partial(best_choice_slow, decimal_places=3)
+# to choose on the grid of the lab app
+def best_choice_slow(gamma, c, q, a, p_manager, decimal_places=2):
+    others = other_qs(q)
+    best_q = best_reply(gamma, c, a, others, decimal_places)
+    # the best grid point is only chosen if it beats last round's payoff
+    return np.where(manager_payoff(gamma, c, a, best_q, others) > p_manager, best_q, q)
 
 
-def payoff_function_firm(gamma, c, q, other_qs):
-    payoff_sum = 0
-    for other_q in other_qs:
-        pay = c * q * (1 - q - gamma * other_q)
-        payoff_sum += max(pay, 0)
-    payoff = payoff_sum/len(other_qs)
-    return payoff
+def half_way_best_choice_slow(gamma, c, q, a, p_manager, decimal_places=2):
+    best_q = best_choice_slow(gamma, c, q, a, p_manager, decimal_places)
+    return q + (best_q - q)/2
 
 
-def best_choice_slow(gamma, c, player, other_players, previous_round):
-    best_p = player.p_manager_history[previous_round]
-    best_q = player.q_history[previous_round]
-    a = player.a_history[previous_round]
-    other_qs = []
-    for other_player in other_players:
-        other_qs = other_qs + [other_player.q_history[previous_round]]
-    for i in range(0, 101):
-        if payoff_function_manager(gamma, c, a, i/100, other_qs) > best_p:
-            best_p = payoff_function_manager(gamma, c, a, i/100, other_qs)
-            best_q = i/100
-    return best_q
+# exact best reply, not restricted to a grid
+def best_choice(gamma, c, q, a, p_manager):
+    return best_reply(gamma, c, a, other_qs(q))
 
 
-def half_way_best_choice_slow(gamma, c, player, other_players, previous_round):
-    best_p = player.p_manager_history[previous_round]
-    old_q = player.q_history[previous_round]
-    best_q = player.q_history[previous_round]
-    a = player.a_history[previous_round]
-    other_qs = []
-    for other_player in other_players:
-        other_qs = other_qs + [other_player.q_history[previous_round]]
-    for i in range(0, 101):
-        if payoff_function_manager(gamma, c, a, i/100, other_qs) > best_p:
-            best_p = payoff_function_manager(gamma, c, a, i/100, other_qs)
-            best_q = i/100
-    return old_q + (best_q - old_q)/2
+def best_choice_wrong(gamma, c, q, a, p_manager):
+    n = q.shape[1]
+    other_qs_sum = q.sum(axis=1, keepdims=True) - q
+    return (1/2)*(a - gamma*other_qs_sum/(n - 1))
 
 
-def best_choice_wrong(gamma, c, player, other_players, previous_round):
-    a = player.a_history[previous_round]
-    other_qs = []
-    for other_player in other_players:
-        other_qs = other_qs + [other_player.q_history[previous_round]]
-    best_q = (1/2)*(a-gamma*sum(other_qs)/len(other_players))
-    return best_q
+def half_way_best_choice_wrong(gamma, c, q, a, p_manager):
+    best_q = best_choice_wrong(gamma, c, q, a, p_manager)
+    return q + (best_q - q)/2
 
 
-def half_way_best_choice_wrong(gamma, c, player, other_players, previous_round):
-    old_q = player.q_history[previous_round]
-    a = player.a_history[previous_round]
-    other_qs = []
-    for other_player in other_players:
-        other_qs = other_qs + [other_player.q_history[previous_round]]
-    best_q = (1 / 2) * (a - gamma * sum(other_qs) / len(other_players))
-    return old_q + (best_q - old_q)/2
+# copy the decision of the last other player in the market who earned more than oneself
+def mimic_choice(gamma, c, q, a, p_manager):
+    n = q.shape[1]
+    better = p_manager[:, None, :] > p_manager[:, :, None]     # better[i, j, k]: k earned more than j
+    better[:, np.arange(n), np.arange(n)] = False
+    last_better = n - 1 - better[:, :, ::-1].argmax(axis=2)
+    mimic_q = np.take_along_axis(q, last_better, axis=1)
+    return np.where(better.any(axis=2), mimic_q, q)
 
 
-def mimic_choice(gamma, c, player, other_players, previous_round):
-    best_p = player.p_manager_history[previous_round]
-    best_q = player.q_history[previous_round]
-    for i in range(len(other_players)):
-        if other_players[i].p_manager_history[previous_round] > best_p:
-            best_q = other_players[i].q_history[previous_round]
-    return best_q
+def always_half(gamma, c, q, a, p_manager):
+    return np.full(q.shape, 0.5)
 
 
-def always_half(gamma, c, player, other_players, previous_round):
-    return 0.5
+# noise functions draw from rng, the simulation passes its own generator (see evolv_random)
+def uniform_noise(lower, upper, mean, variance, size=None, rng=np.random):
+    return rng.uniform(lower, upper, size)
 
 
-def uniform_noise(lower, upper, mean, variance):
-    return random.uniform(lower, upper)
+def normal_noise(lower, upper, mean, variance, size=None, rng=np.random):
+    return rng.normal(mean, variance, size)
 
 
-def normal_noise(lower, upper, mean, variance):
-    return random.normalvariate(mean, variance)
+# name of a parameter for the metadata, functools.partial by the name and keywords of its function
+def function_name(value):
+    if isinstance(value, functools.partial):
+        return dict(name=function_name(value.func), args=list(value.args), keywords=value.keywords)
+    if callable(value):
+        return getattr(value, '__name__', repr(value))
+    return value
+
+
+# parameters of Simulation, missing ones keep the class defaults
+PARAMETER_NAMES = (
+    'n', 'a_min', 'a_max', 'q_min', 'q_max', 't', 'm', 'gamma', 'c', 'initial_a', 'initial_q',
+    'evolution_every_x_rounds', 'noise_uniform_lower', 'noise_uniform_upper', 'noise_normal_mean',
+    'noise_normal_variance', 'noise_func', 'prob_evolv_min', 'prob_evolv_max', 'prob_imitation_min',
+    'prob_imitation_max', 'choice_func', 'evo_mech', 'history_dtype', 'seed', 'rng_streams', 'first_market',
+    'recording', 'recording_k', 'output',
+)
+REPORTED_MISSING = set()
 
 
 class Simulation:
@@ -200,116 +159,83 @@ class Simulation:
     noise_uniform_upper = 0.1
     noise_normal_mean = 0
     noise_normal_variance = 0.1
-    noise_func = uniform_noise
+    noise_func = staticmethod(uniform_noise)
     prob_evolv_min = 0
     prob_evolv_max = 0.8
     prob_imitation_min = 0
     prob_imitation_max = 0.8
-    choice_func = always_half
+    choice_func = staticmethod(always_half)
     evo_mech = 'best'
-    markets = []
+    history_dtype = 'float64'           # 'float32' halves the memory of the history
+    seed = None                         # int or numpy SeedSequence, None draws fresh entropy
+    rng_streams = 'simulation'          # 'simulation': one stream, 'market': streams by market number (see evolv_random.MarketStreams)
+    first_market = 0                    # number of the first market, to simulate a chunk of a larger run with rng_streams='market'
+    recording = 'full'                  # 'full', 'last' (last recording_k ticks), 'every' (every recording_k-th tick) or 'aggregates'
+    recording_k = 100
+    output = None                       # directory to write the full history to as memory mapped .npy files, see evolv_store
 
     def __init__(self, parameters):
-        # assigning parameters
-        try:
-            self.n = parameters['n']
-        except KeyError:
-            print('parameter n missing, default taken')
-        try:
-            self.a_min = parameters['a_min']
-        except KeyError:
-            print('parameter a_min missing, default taken')
-        try:
-            self.a_max = parameters['a_max']
-        except KeyError:
-            print('parameter a_max missing, default taken')
-        try:
-            self.q_min = parameters['q_min']
-        except KeyError:
-            print('parameter q_min missing, default taken')
-        try:
-            self.q_max = parameters['q_max']
-        except KeyError:
-            print('parameter q_max missing, default taken')
-        try:
-            self.t = parameters['t']
-        except KeyError:
-            print('parameter t missing, default taken')
-        try:
-            self.m = parameters['m']
-        except KeyError:
-            print('parameter m missing, default taken')
-        try:
-            self.gamma = parameters['gamma']
-        except KeyError:
-            print('parameter gamma missing, default taken')
-        try:
-            self.c = parameters['c']
-        except KeyError:
-            print('parameter c missing, default taken')
-        try:
-            self.initial_a = parameters['initial_a']
-        except KeyError:
-            print('parameter initial_a missing, default taken')
-        try:
-            self.initial_q = parameters['initial_q']
-        except KeyError:
-            print('parameter initial_q missing, default taken')
-        try:
-            self.evolution_every_x_rounds = parameters['evolution_every_x_rounds']
-        except KeyError:
-            print('parameter evolution_every_x_rounds missing, default taken')
-        try:
-            self.noise_uniform_lower = parameters['noise_uniform_lower']
-        except KeyError:
-            print('parameter noise_uniform_lower missing, default taken')
-        try:
-            self.noise_uniform_upper = parameters['noise_uniform_upper']
-        except KeyError:
-            print('parameter noise_uniform_upper missing, default taken')
-        try:
-            self.noise_normal_mean = parameters['noise_normal_mean']
-        except KeyError:
-            print('parameter noise_normal_mean missing, default taken')
-        try:
-            self.noise_normal_variance = parameters['noise_normal_variance']
-        except KeyError:
-            print('parameter noise_normal_variance missing, default taken')
-        try:
-            self.prob_evolv_min = parameters['prob_evolv_min']
-        except KeyError:
-            print('parameter prob_evolv_min missing, default taken')
-        try:
-            self.prob_evolv_max = parameters['prob_evolv_max']
-        except KeyError:
-            print('parameter prob_evolv_max missing, default taken')
-        try:
-            self.prob_imitation_min = parameters['prob_imitation_min']
-        except KeyError:
-            print('parameter prob_imitation_min missing, default taken')
-        try:
-            self.prob_imitation_max = parameters['prob_imitation_max']
-        except KeyError:
-            print('parameter prob_imitation_max missing, default taken')
-        try:
-            self.choice_func = parameters['choice_func']
-        except KeyError:
-            print('parameter choice_func missing, default taken')
-        try:
-            self.noise_func = parameters['noise_func']
-        except KeyError:
-            print('parameter noise_func missing, default taken')
-        try:
-            self.evo_mech = parameters['evo_mech']
-        except KeyError:
-            print('parameter evo_mech missing, default taken')
-
-        # initiate players in markets
-        for i in range(self.m):
-            group = []
-            for j in range(self.n):
-                group.append(Player(self.a_min, self.a_max, self.q_min, self.q_max))
-            self.markets.append(group)
+        # assigning parameters, missing ones keep the class defaults. they are reported once per set of missing names,
+        # so sweeps and benchmarks that leave the same ones out print a single line
+        for name in PARAMETER_NAMES:
+            if name in parameters:
+                setattr(self, name, parameters[name])
+        missing = tuple(name for name in PARAMETER_NAMES if name not in parameters)
+        if missing and missing not in REPORTED_MISSING:
+            REPORTED_MISSING.add(missing)
+            print('parameters ' + ', '.join(missing) + ' missing, defaults taken')
+
+        # random streams, derived from one seed sequence so a run can be reproduced from self.seed
+        self.seed = seed_sequence(self.seed)
+        if self.rng_streams == 'simulation':
+            self.rng = generator(self.seed)
+        elif self.rng_streams == 'market':
+            self.rng = MarketStreams(self.seed, range(self.first_market, self.first_market + self.m))
+        else:
+            raise ValueError('unknown rng_streams ' + repr(self.rng_streams))
+
+        # histories of all players in all markets, kept according to the recording policy, see evolv_history
+        if self.output is None:
+            self.history = make_history(self.recording, self.m, self.n, self.t, self.recording_k, self.history_dtype)
+        elif self.recording == 'full':
+            self.history = MemmapHistory(self.output, self.m, self.n, self.t, self.history_dtype, self.metadata())
+        else:
+            raise ValueError('output only supports recording full')
+        a = uniform_noise(self.a_min, self.a_max, 0, 0, (self.m, self.n), self.rng)
+        q = uniform_noise(self.q_min, self.q_max, 0, 0, (self.m, self.n), self.rng)
+        self.history.record(0, q, a, np.zeros((self.m, self.n)), np.zeros((self.m, self.n)))
+        self.state = (q, a, np.zeros((self.m, self.n)))
+
+        # per player views on the histories
+        self.markets = [[Player(self, i, j) for j in range(self.n)] for i in range(self.m)]
+
+    # parameters and seed of the run, json serializable (functions by name) to store next to the history
+    def metadata(self):
+        parameters = {}
+        for name in PARAMETER_NAMES:
+            if name != 'seed':
+                parameters[name] = function_name(getattr(self, name))
+        return dict(
+            parameters=parameters,
+            seed=dict(entropy=self.seed.entropy, spawn_key=list(self.seed.spawn_key)),
+        )
+
+    # histories as arrays of shape (markets, players, ticks), history.ticks are the rounds they cover
+    @property
+    def q_history(self):
+        return self.history.series('q_history')
+
+    @property
+    def a_history(self):
+        return self.history.series('a_history')
+
+    @property
+    def p_manager_history(self):
+        return self.history.series('p_manager_history')
+
+    @property
+    def p_firm_history(self):
+        return self.history.series('p_firm_history')
 
     def run_simulation(self):
         g = self.gamma
@@ -318,102 +244,81 @@ class Simulation:
         upper = self.noise_uniform_upper
         mean = self.noise_normal_mean
         variance = self.noise_normal_variance
+        shape = (self.m, self.n)
+        markets = np.arange(self.m)[:, None]
+        rng = self.rng
+        # only the previous round is needed to step the simulation, it is kept in full precision
+        q, a, p_manager = self.state
         for i in range(self.t-1):
 
             # chose q phase
-            for market in self.markets:
-                for player in market:
-                    other_players = market + []
-                    other_players.remove(player)
-                    new_q = self.choice_func(g, c, player, other_players, i)
-                    new_q += self.noise_func(lower, upper, mean, variance)
-                    if new_q > 1:
-                        new_q = 1
-                    elif new_q < 0:
-                        new_q = 0
-                    player.q_history = player.q_history+[new_q]
+            new_q = self.choice_func(g, c, q, a, p_manager)
+            new_q = new_q + self.noise_func(lower, upper, mean, variance, shape, rng)
+            new_q = np.clip(new_q, 0, 1)
 
             # calc p phase
-            for market in self.markets:
-                for player in market:
-                    q = player.q_history[-1]
-                    other_players = market + []
-                    other_players.remove(player)
-                    other_qs = []
-                    for other_player in other_players:
-                        other_qs = other_qs + [other_player.q_history[-1]]
-                    a = player.a_history[-1]
-                    player.p_manager_history = player.p_manager_history+[payoff_function_manager(g, c, a, q, other_qs)]
-                    player.p_firm_history = player.p_firm_history + [payoff_function_firm(g, c, q, other_qs)]
+            p_manager = market_payoff_manager(g, c, a, new_q)
+            fitness = market_payoff_firm(g, c, new_q)
 
+            new_a = a
             # Evolution selection
             if i % self.evolution_every_x_rounds == 0:
-                # prob evolution
-                for market in self.markets:
-                    prob_list = list(np.linspace(self.prob_evolv_min, self.prob_evolv_max, self.n))
-                    fitness_list = []
-                    players = market + []
-                    for player in players:
-                        fitness_list = fitness_list + [player.p_firm_history[-1]]
-                    prob_list = [x for _, x in sorted(zip(fitness_list, prob_list), key=lambda pair: pair[0])]
-                    prob_list.reverse()
-                    for j in range(len(players)):
-                        random_num = random.random()
-                        if prob_list[j] > random_num:
-                            players[j].evolv = True
-                        else:
-                            players[j].evolv = False
+                # prob evolution, the probability rises linearly from the fittest to the least fit player
+                prob_list = np.linspace(self.prob_evolv_min, self.prob_evolv_max, self.n)
+                rank = (-fitness).argsort(axis=1, kind='stable').argsort(axis=1, kind='stable')
+                evolv = prob_list[rank] > rng.random(shape)
 
                 # imitation weighted_average (as in models.py)
                 if self.evo_mech == 'weighted_average':
-                    for market in self.markets:
-                        all_payoff_windows = []
-                        prev_a_vars = []
-                        for player in market:
-                            all_payoff_windows = all_payoff_windows + [player.p_firm_history[-1]]
-                            prev_a_vars = prev_a_vars + [player.a_history[-1]]
-                        for player in market:
-                            if player.evolv:
-                                avg_payoff_window = sum(all_payoff_windows) / len(all_payoff_windows)
-                                weights = [max(0, poff - avg_payoff_window) for poff in all_payoff_windows]
-
-                                new_a = weighted_choice(prev_a_vars, weights)
-                                new_a += self.noise_func(lower, upper, mean, variance)
-                            else:
-                                new_a = player.a_history[-1]
-                            player.a_history = player.a_history + [new_a]
+                    avg_payoff_window = fitness.mean(axis=1, keepdims=True)
+                    weights = np.maximum(0, fitness - avg_payoff_window)
+                    cum_weights = weights.cumsum(axis=1)
+                    rand = rng.random(shape) * cum_weights[:, -1:]
+                    # index of the first cumulative weight above rand, the imitated player is drawn with probability proportional to its weight
+                    target = (cum_weights[:, None, :] <= rand[:, :, None]).sum(axis=2)
+                    target = np.minimum(target, self.n - 1)
+                    imitated_a = a[markets, target]
 
                 # imitation best
-                if self.evo_mech == 'best':
-                    for market in self.markets:
-                        players = market + []
-                        best_player = sorted(players, key=lambda play: play.p_firm_history[-1], reverse=False)[-1]
-                        for player in market:
-                            if player.evolv:
-                                new_a = best_player.a_history[-1] + self.noise_func(lower, upper, mean, variance)
-                                player.a_history = player.a_history + [new_a]
-                            else:
-                                player.a_history = player.a_history + [player.a_history[-1]]
-
-            # round without evolv
-            else:
-                for market in self.markets:
-                    for player in market:
-                        player.a_history = player.a_history + [player.a_history[-1]]
+                elif self.evo_mech == 'best':
+                    best_player = self.n - 1 - fitness[:, ::-1].argmax(axis=1)
+                    imitated_a = a[markets, best_player[:, None]]
+
+                else:
+                    raise ValueError('unknown evo_mech ' + repr(self.evo_mech))
+
+                imitated_a = imitated_a + self.noise_func(lower, upper, mean, variance, shape, rng)
+                new_a = np.where(evolv, imitated_a, a)
 
+            # round without evolv keeps a
+            self.history.record(i+1, new_q, new_a, p_manager, fitness)
+            q, a = new_q, new_a
+        self.state = (q, a, p_manager)
+        self.history.close()
 
+
+# view on a single player's histories in the simulation arrays
 class Player:
-    a_history = []
-    q_history = []
-    p_manager_history = []      # payoff
-    p_firm_history = []         # fitness value
-    evolv = False
+    def __init__(self, simulation, market, index):
+        self.simulation = simulation
+        self.market = market
+        self.index = index
+
+    @property
+    def q_history(self):
+        return self.simulation.q_history[self.market, self.index]
+
+    @property
+    def a_history(self):
+        return self.simulation.a_history[self.market, self.index]
+
+    @property
+    def p_manager_history(self):
+        return self.simulation.p_manager_history[self.market, self.index]
 
-    def __init__(self, a_min, a_max, q_min, q_max):
-        self.a_history = [uniform_noise(a_min, a_max, 0, 0)]
-        self.q_history = [uniform_noise(q_min, q_max, 0, 0)]
-        self.p_manager_history = [0]
-        self.p_firm_history = [0]
+    @property
+    def p_firm_history(self):
+        return self.simulation.p_firm_history[self.market, self.index]
 
 
 if __name__ == "__main__":
@@ -440,7 +345,14 @@ if __name__ == "__main__":
         prob_imitation_min=0,       # unused?
         prob_imitation_max=0.8,     # unused?
         choice_func=best_choice_slow,
-        evo_mech='weighted_average'             # 'best' or 'weighted_average' (as in models.py)
+        evo_mech='weighted_average',            # 'best' or 'weighted_average' (as in models.py)
+        history_dtype='float64',      # 'float32' halves the memory of the history
+        seed=None,                    # int for a reproducible run, None draws fresh entropy
+        rng_streams='simulation',     # 'simulation' or 'market' (streams by market number, chunks reproduce the full run)
+        first_market=0,               # first market of a chunk of a larger run, with rng_streams='market'
+        recording='full',             # 'full', 'last', 'every' or 'aggregates', see evolv_history
+        recording_k=100,
+        output=None,                  # directory for memory mapped .npy histories, see evolv_store
     )
 
     sim = Simulation(para)
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+# per tick statistics over markets of a history series. every market is summarized by the average over its players,
+# mean, variance (sample variance, like statistics.variance), min, max and quantiles are taken over these market averages.
+# all arrays have one entry per tick, quantiles has shape (len(quantile_levels), ticks), ticks are round numbers starting at 1
+class TickStats:
+    def __init__(self, ticks, mean, variance, minimum, maximum, quantile_levels, quantiles):
+        self.ticks = ticks
+        self.mean = mean
+        self.variance = variance
+        self.min = minimum
+        self.max = maximum
+        self.quantile_levels = tuple(quantile_levels)
+        self.quantiles = quantiles
+
+    def quantile(self, level):
+        return self.quantiles[self.quantile_levels.index(level)]
+
+
+# statistics of market averages of shape (markets, ticks) in one vectorized pass over the markets
+def tick_stats(means, ticks=None, quantile_levels=QUANTILES):
+    if ticks is None:
+        ticks = np.arange(1, means.shape[1] + 1)
+    return TickStats(
+        ticks,
+        means.mean(axis=0),
+        means.var(axis=0, ddof=1),
+        means.min(axis=0),
+        means.max(axis=0),
+        quantile_levels,
+        np.quantile(means, quantile_levels, axis=0),
+    )
+
@@ -0,0 +1,129 @@
+import functools
+import json
+import os
+
+import numpy as np
+
+from evolv_history import SERIES, History
+from evolv_stats import QUANTILES, tick_stats
+
+
+METADATA_FILE = 'metadata.json'
+
+# parameters that the metadata holds by function name (see evolv_simu.function_name)
+FUNCTION_PARAMETERS = ('noise_func', 'choice_func')
+
+
+# full history that is written to disk while the simulation runs, one memory mapped .npy file per series
+# in directory path, tick major (ticks, markets, players) like the in memory block.
+# the pages of finished ticks are flushed every flush_every ticks, so the run does not have to fit into memory,
+# and metadata.json next to the arrays holds the parameters, the seed and how many ticks are written.
+# mode 'r' opens the files of an existing run read only, m, n, t and dtype are then taken from the metadata
+class MemmapHistory(History):
+    def __init__(self, path, m=None, n=None, t=None, dtype=np.float64, metadata=None, flush_every=100, mode='w+'):
+        self.path = path
+        self.flush_every = flush_every
+        self.mode = mode
+        if mode == 'r':
+            with open(os.path.join(path, METADATA_FILE)) as metadata_file:
+                self.metadata = json.load(metadata_file)
+            self.arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in SERIES]
+        else:
+            self.metadata = dict(metadata or {}, m=m, n=n, t=t, dtype=np.dtype(dtype).name, filled=0)
+            os.makedirs(path, exist_ok=True)
+            self.arrays = [np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode=mode, dtype=dtype, shape=(t, m, n))
+                           for name in SERIES]
+            self.write_metadata()
+        self.m = self.metadata['m']
+        self.n = self.metadata['n']
+        self.t = self.metadata['t']
+        self.filled = self.metadata['filled']
+
+    def write(self, slot, q, a, p_manager, p_firm):
+        if self.mode == 'r':
+            raise ValueError('stored runs are read only')
+        for array, values in zip(self.arrays, (q, a, p_manager, p_firm)):
+            array[slot] = values
+        if (slot + 1) % self.flush_every == 0:
+            self.flush(slot + 1)
+
+    def flush(self, filled):
+        for array in self.arrays:
+            array.flush()
+        self.metadata['filled'] = filled
+        self.write_metadata()
+
+    def close(self):
+        if self.mode != 'r':
+            self.flush(self.filled)
+
+    def write_metadata(self):
+        with open(os.path.join(self.path, METADATA_FILE), 'w') as metadata_file:
+            json.dump(self.metadata, metadata_file, indent=2)
+
+    def series(self, name):
+        return self.arrays[SERIES.index(name)][:self.filled].transpose(1, 2, 0)
+
+    # reads chunk_size ticks at a time, only the market averages (markets x ticks) are kept in memory
+    def stats(self, name, quantile_levels=QUANTILES, chunk_size=256):
+        array = self.arrays[SERIES.index(name)]
+        market_means = np.empty((self.m, self.filled))
+        for start in range(0, self.filled, chunk_size):
+            market_means[:, start:start + chunk_size] = np.asarray(array[start:start + chunk_size]).mean(axis=2).T
+        return tick_stats(market_means, self.ticks, quantile_levels)
+
+
+# a finished (or interrupted) run in directory path, opened lazily and read only.
+# it has the parts of a Simulation that the analysis uses: the parameters, history, the *_history arrays
+# and t, so show_stats(open_run(path), 'a_history') works without running the simulation again
+class StoredRun:
+    def __init__(self, path):
+        self.history = MemmapHistory(path, mode='r')
+        self.parameters = self.history.metadata.get('parameters', {})
+        self.m = self.history.m
+        self.n = self.history.n
+        self.t = self.history.filled
+
+    # seed sequence of the run
+    @property
+    def seed(self):
+        seed = self.history.metadata['seed']
+        return np.random.SeedSequence(seed['entropy'], spawn_key=tuple(seed['spawn_key']))
+
+    # parameters to run it again, Simulation(run.parameters_for_rerun()) repeats the run in memory.
+    # the functions are looked up by name in evolv_simu, the output directory is left out
+    def parameters_for_rerun(self):
+        import evolv_simu
+        parameters = {name: value for name, value in self.parameters.items() if name != 'output'}
+        for name in FUNCTION_PARAMETERS:
+            if name in parameters:
+                parameters[name] = stored_function(parameters[name], evolv_simu)
+        parameters['seed'] = self.seed
+        return parameters
+
+    @property
+    def q_history(self):
+        return self.history.series('q_history')
+
+    @property
+    def a_history(self):
+        return self.history.series('a_history')
+
+    @property
+    def p_manager_history(self):
+        return self.history.series('p_manager_history')
+
+    @property
+    def p_firm_history(self):
+        return self.history.series('p_firm_history')
+
+
+# function of a stored parameter, a name in module or a functools.partial stored as dict(name, args, keywords)
+def stored_function(value, module):
+    if isinstance(value, dict):
+        return functools.partial(stored_function(value['name'], module), *value['args'], **value['keywords'])
+    return getattr(module, value)
+
+
+def open_run(path):
+    return StoredRun(path)
@@ -0,0 +1,114 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import evolv_simu
+from evolv_random import seed_sequence
+
+
+# choice_func and noise_func are given by their name in evolv_simu so cells can be sent to other processes
+FUNCTION_PARAMETERS = ('choice_func', 'noise_func')
+
+
+# all combinations of a parameter grid, e.g. dict(gamma=[0.5, 1], evo_mech=['best', 'weighted_average'])
+# scalars in the grid are kept fixed
+def grid_cells(grid):
+    names = list(grid)
+    values = [value if isinstance(value, (list, tuple)) else [value] for value in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def simulation_parameters(cell):
+    parameters = {}
+    for name in evolv_simu.PARAMETER_NAMES:
+        value = cell.get(name, getattr(evolv_simu.Simulation, name))
+        if name in FUNCTION_PARAMETERS and isinstance(value, str):
+            value = getattr(evolv_simu, value)
+        parameters[name] = value
+    return parameters
+
+
+# default summary of a run: cross market mean and variance of every series in the last tick
+def summarize_run(simulation):
+    summary = {}
+    for name in evolv_simu.SERIES:
+        stats = simulation.history.stats(name)
+        summary['final_' + name[:-len('_history')] + '_mean'] = float(stats.mean[-1])
+        summary['final_' + name[:-len('_history')] + '_variance'] = float(stats.variance[-1])
+    return summary
+
+
+# runs one replication of one cell, errors are returned as part of the row so one bad cell does not stop the sweep.
+# the random streams of a run are keyed by (cell_id, replication) under the sweep's seed, so every run
+# is reproducible on its own and the results do not depend on the number of workers or the order of the runs
+def run_cell(cell_id, cell, replication, seed, summarize=summarize_run):
+    row = dict(cell_id=cell_id, replication=replication, seed=seed)
+    row.update({name: value.__name__ if callable(value) else value for name, value in cell.items()})
+    start = time.time()
+    try:
+        parameters = simulation_parameters(cell)
+        parameters['seed'] = seed_sequence(seed, cell_id, replication)
+        simulation = evolv_simu.Simulation(parameters)
+        simulation.run_simulation()
+        row.update(summarize(simulation))
+        row['error'] = ''
+    except Exception:
+        row['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    row['seconds'] = round(time.time() - start, 3)
+    return row
+
+
+# runs every cell of the grid replications times on a pool of workers processes.
+# returns one row per run, sorted by cell and replication, with the cell parameters, the summary and an error column
+def run_sweep(grid, replications=1, workers=None, seed=0, summarize=summarize_run, progress=True):
+    cells = grid_cells(grid)
+    tasks = [(cell_id, cell, replication, seed)
+             for cell_id, cell in enumerate(cells) for replication in range(replications)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_cell, *task, summarize) for task in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            rows.append(row)
+            if progress:
+                status = 'failed: ' + row['error'] if row['error'] else 'done'
+                print(f'[{done}/{len(tasks)}] cell {row["cell_id"]} replication {row["replication"]} {status}',
+                      file=sys.stderr)
+    rows.sort(key=lambda row: (row['cell_id'], row['replication']))
+    return rows
+
+
+def write_rows(rows, path):
+    fieldnames = []
+    for row in rows:
+        fieldnames += [name for name in row if name not in fieldnames]
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# python evolv_sweep.py grid.json --replications 10 --workers 8 --output sweep.csv
+# grid.json holds the parameter grid, lists are swept, everything else is fixed, e.g.
+# {"m": 1000, "t": 300, "gamma": [0.5, 1.0], "choice_func": ["best_choice_slow", "mimic_choice"]}
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='parameter sweep over evolv_simu.Simulation')
+    parser.add_argument('grid', help='json file with the parameter grid')
+    parser.add_argument('--replications', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='sweep.csv')
+    args = parser.parse_args()
+
+    with open(args.grid) as grid_file:
+        grid = json.load(grid_file)
+    rows = run_sweep(grid, args.replications, args.workers, args.seed)
+    write_rows(rows, args.output)
+    failed = sum(1 for row in rows if row['error'])
+    print(f'{len(rows)} runs written to {args.output}, {failed} failed', file=sys.stderr)
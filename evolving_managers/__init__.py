@@ -1,9 +1,15 @@
-from argparse import Action
-from os import stat
+from urllib.parse import urlencode
 from otree.api import *
+from otree.database import db
 import time
 import random
-import csv
+
+import lab_protocol
+from lab_protocol import (LIVE_PROTOCOL, MESSAGE_FIELDS, MESSAGE_TYPES, ROUTE_PARAM, TreatmentSchedule, encode_message,
+                          evolve_population, keyed_random, load_schedule, population_confidence)
+from . import scheduler
+from .group_state import GroupState, cached_group_state, cached_group_state_by_id, drop_group_states, get_group_state
+from .timing import GroupTiming, timing_report
 
 
 doc = """
@@ -15,13 +21,15 @@ class C(BaseConstants):
     PLAYERS_PER_GROUP = 2
     NUM_ROUNDS = 60 # number of supergames
     ACTION_DECIMAL_PLACES = 3 # how fine is the action grid (bounded by 0 and 1). with 3 it's 0, 0.001, 0.002, etc
-    NOISE_RANGE = 0.3 # support for noise when imitating, ~U[-NOISE_RANGE/2,NOISE_RANGE/2]
-    MIN_CONFIDENCE = 0.5
-    MAX_CONFIDENCE = 2.0
+    NOISE_RANGE = lab_protocol.NOISE_RANGE # support for noise when imitating, shared with the offline tools
+    MIN_CONFIDENCE = lab_protocol.MIN_CONFIDENCE
+    MAX_CONFIDENCE = lab_protocol.MAX_CONFIDENCE
+    OBSERVATION_BUFFER_SIZE = 64 # observations of a group that are kept in memory before they are written
+    EXPORT_CHUNK_SIZE = 10000 # observations that custom_export fetches from the database at a time
 
 
 class Subsession(BaseSubsession):
-    pass
+    seed = models.StringField() # seed of the session's random draws (lab_protocol.keyed_random), the same in every round
 
 
 class Group(BaseGroup):
@@ -35,6 +43,7 @@ class Group(BaseGroup):
     supergame_started = models.BooleanField(initial=False) # track whether the supergame has started
     num_periods = models.IntegerField() # how many periods are in a supergame
     session_config = models.StringField()
+    message_seq = models.IntegerField(initial=0) # sequence number of the last live message sent to both players
 
 
 class Player(BasePlayer):
@@ -77,13 +86,30 @@ class Observations(ExtraModel):
     relative_payoff_info = models.BooleanField() # treatment variable, whether there is additional information on relative payoffs
 
 
+class Timings(ExtraModel):
+    subsession = models.Link(Subsession)
+    group = models.Link(Group)
+    supergame = models.IntegerField()
+    ready_messages = models.IntegerField() # number of 'ready' messages of both players
+    update_messages = models.IntegerField() # number of 'update' messages (client scheduler) of both players
+    action_messages = models.IntegerField() # number of 'action' messages (server scheduler) of both players
+    handling_mean = models.FloatField() # average time live_method took per message (ms)
+    handling_max = models.FloatField() # longest time live_method took for a message (ms)
+    handling_histogram = models.LongStringField() # json list of counts per bucket of timing.HANDLING_BUCKETS
+    drift_histogram = models.LongStringField() # arrival of updates minus expected timestamp (ms), buckets of timing.DRIFT_BUCKETS
+    correction_histogram = models.LongStringField() # how much the next period was shortened (ms), buckets of timing.CORRECTION_BUCKETS
+    late_p1 = models.IntegerField() # updates of player 1 that arrived more than timing.LATE_MSECONDS late
+    late_p2 = models.IntegerField() # updates of player 2 that arrived more than timing.LATE_MSECONDS late
+    clamped = models.IntegerField() # periods whose correction was capped by max_adjustment
+
+
 # PAGES
 class Instructions(Page):
     # on the instructions page send some data to the template: number of supergames, number of periods within each supergame, how long each period is (in seconds) and how many points convert to one Euro
     # also, obviously, only display this page in the first supergame, and don't if we are running a simulation
     @staticmethod
     def vars_for_template(player: Player):
-        current_config = [config for config in player.participant.configs if config['start_supergame'] <= player.round_number and config['end_supergame'] >= player.round_number][0]
+        current_config = session_schedule(player.session)[player.round_number]
         return dict(
             num_rounds = current_config['end_supergame'] - current_config['start_supergame'] + 1,
             num_periods = player.group.num_periods,
@@ -95,11 +121,11 @@ class Instructions(Page):
             )
 
     def is_displayed(player):
-        current_config = [config for config in player.participant.configs if config['start_supergame'] <= player.round_number and config['end_supergame'] >= player.round_number][0]
+        current_config = session_schedule(player.session)[player.round_number]
         # only show instructions page at the beginning of a new supergame and if we are not simulating
         #return player.session.config['simulation'] == False and player.subsession.round_number == current_config['start_supergame'] # can be used to run different treatments with alternative instructions between-subjects
         #return player.session.config['simulation'] == False and player.subsession.round_number == 1
-        return player.subsession.round_number == 1
+        return player.subsession.round_number == 1 and not fast_forwarded(player.session)
 
 
 class SetupWaitPage(WaitPage):
@@ -107,47 +133,38 @@ class SetupWaitPage(WaitPage):
     wait_for_all_groups = True
     @staticmethod
     def after_all_players_arrive(subsession: Subsession):
-        groups = subsession.get_groups()
-        for group in groups:
-            players = group.get_players()
-            for p in players:
-                p.timestamp = time.time() * 1000
-                partner = p.get_others_in_group()[0]
-                p.period_payoff = payoff_function('payoff', p, partner)
-                p.period_fitness = payoff_function('fitness', p, partner)
+        start_supergame(subsession)
 
-            # if we are running a simulation, let managers play Nash in all rounds
-            if p.session.config['simulation'] == True:
-                for p in players:
-                    partner = p.get_others_in_group()[0]
-                    p.action = (2*p.confidence - p.group.gamma*partner.confidence)/(4-p.group.gamma*p.group.gamma)
-                for p in players:
-                    partner = p.get_others_in_group()[0]
-                    p.period_payoff = payoff_function('payoff', p, partner)
-                    p.period_fitness = payoff_function('fitness', p, partner)
+    def is_displayed(player):
+        return not fast_forwarded(player.session)
 
-            update_group_vars(group) # use this function to update all the group values after the player variables have all been set
-            group.expected_timestamp = max([p.timestamp for p in players])
 
-            for p in players:
-                save_period(p) # save data for all players
+class Decision(Page):
+    def is_displayed(player):
+        return not fast_forwarded(player.session)
 
+    # the live socket carries the group, so lab_router.py sends the whole group to one process
+    def live_url(self):
+        return super().live_url() + '&' + urlencode({ROUTE_PARAM: self.player.group_id})
 
-class Decision(Page):
     @staticmethod
     def vars_for_template(player: Player):
-        current_config = [config for config in player.participant.configs if config['start_supergame'] <= player.round_number and config['end_supergame'] >= player.round_number][0]
+        current_config = session_schedule(player.session)[player.round_number]
+        # on a reload during the supergame the cached group state is more recent than the database
+        group = cached_group_state(player.group)
+        state = group.get_player_by_id(player.id_in_group) if group else player
+        group = group or player.group
         # if we are in the first period, it is not incentivized, so simply return a period payoff of zero. 
-        if player.period == 0:
+        if state.period == 0:
             period_payoff = float(0)
         # whenever the page is (re)loaded, the current period payoff and the cumulative payoff up to that period are sent to the page
         else:
-            period_payoff = round(player.period_payoff,1)
+            period_payoff = round(state.period_payoff,1)
 
         return dict(
-            round_payoff = round(player.round_payoff,1),
+            round_payoff = round(state.round_payoff,1),
             period_payoff = period_payoff,
-            period = player.group.period + 1,
+            period = group.period + 1,
             max_rounds = current_config['end_supergame'],
         )
 
@@ -155,12 +172,13 @@ class Decision(Page):
     @staticmethod
     def js_vars(player: Player):
         partner = player.get_others_in_group()[0]
+        group = cached_group_state(player.group) or player.group
         return dict(
             num_periods = player.group.num_periods,
-            p1_action = player.group.p1_action,
-            p2_action = player.group.p2_action,
-            p1_period_payoff = player.group.p1_period_payoff,
-            p2_period_payoff = player.group.p2_period_payoff,
+            p1_action = group.p1_action,
+            p2_action = group.p2_action,
+            p1_period_payoff = group.p1_period_payoff,
+            p2_period_payoff = group.p2_period_payoff,
             id = player.id_in_group,
             confidence = player.confidence,
             partner_confidence = partner.confidence,
@@ -169,6 +187,10 @@ class Decision(Page):
             gamma = player.group.gamma,
             joint_payoff_info = player.joint_payoff_info,
             relative_payoff_info = player.relative_payoff_info,
+            period_scheduler = player.session.config.get('period_scheduler', 'client'),
+            live_protocol = LIVE_PROTOCOL,
+            message_types = MESSAGE_TYPES,
+            message_fields = MESSAGE_FIELDS,
         )
 
     # we have to work with group variables and not subject variables because of the live page.
@@ -183,115 +205,121 @@ class Decision(Page):
     # there is a transmission and computational delay, also javascript isn't good at keeping a rhythm.
     # to keep the rhythm the server adjusts the next period's length by the bias.
     # there is a maximum negative adjustment time so if one period is delayed by a very long time, the next period is not of length zero.
+    # the group and player variables are served from the in-process group state (see group_state.py) and written back at safe points.
+    # with session.config['period_scheduler'] = 'server' the server ends every period on its own clock instead (see scheduler.py):
+    # the clients send their latest choice as an 'action' message whenever it changes, and when the period is over the server
+    # takes each player's latest action (or keeps the previous one if none arrived) and sends the results to the group.
     @staticmethod
     def live_method(player: Player, data):
         #print(data) # for debugging purposes
         timestamp = time.time() * 1000 # timestamp in milliseconds
-        period_length = player.mseconds_per_period
-        num_periods = player.group.num_periods
-        partner = player.get_others_in_group()[0]
-        p1 = player.group.get_player_by_id(1)
-        p2 = player.group.get_player_by_id(2)
+        start = time.perf_counter()
+        group = get_group_state(player.group)
+        me = group.get_player_by_id(player.id_in_group)
+        partner = group.partner(me)
+        period_length = me.mseconds_per_period
+        num_periods = group.num_periods
+        server_scheduler = player.session.config.get('period_scheduler', 'client') == 'server'
+        response = None
+        finished = False
 
         if data['type'] == 'ready':
-            player.ready = True
-            player.timestamp = timestamp
+            me.ready = True
+            me.timestamp = timestamp
+            if server_scheduler:
+                group.channels[player.id_in_group] = scheduler.live_channel(player)
 
             # if partner is ready and supergame has not started yet, start initial period 0
-            if partner.ready and not player.group.supergame_started:
-                player.group.supergame_started = True
-                return {0: dict(
-                    type = 'start-period',
-                    period = player.group.period,
-                    p1_action = player.group.p1_action,
-                    p2_action = player.group.p2_action,
-                    p1_period_payoff = player.group.p1_period_payoff,
-                    p2_period_payoff = player.group.p2_period_payoff,
-                    p1_round_payoff = p1.round_payoff,
-                    p2_round_payoff = p2.round_payoff,
-                    expected = player.timestamp + period_length,
-                    next_period_length = period_length
-                    )
-                }
+            if partner.ready and not group.supergame_started:
+                group.supergame_started = True
+                if server_scheduler:
+                    group.period_end = timestamp + period_length
+                    scheduler.schedule(group.id, period_length, end_period)
+                response = {0: period_message('start-period', group, me.timestamp + period_length, period_length)}
+
+            # with the server scheduler, a reloaded page joins the running period. the timer is started again if this
+            # process does not have it (the server was restarted)
+            elif partner.ready and group.supergame_started and server_scheduler and group.period < num_periods:
+                if not scheduler.is_scheduled(group.id):
+                    group.period_end = timestamp + period_length
+                    scheduler.schedule(group.id, period_length, end_period)
+                response = {player.id_in_group: period_message('start-period', group, group.period_end, group.period_end - timestamp,
+                                                                broadcast=False)}
 
             # if all players are ready and the game has already started (ie the page has reloaded) 
             # and the player is not ahead of their partner in periods
             # send start signal with current period info to client who reloaded only
-            elif partner.ready and player.group.supergame_started and player.period <= num_periods and player.period <= partner.period: 
-                return {player.id_in_group: dict(
-                    type = 'start-period',
-                    period = player.group.period,
-                    p1_action = player.group.p1_action,
-                    p2_action = player.group.p2_action,
-                    p1_period_payoff = player.group.p1_period_payoff,
-                    p2_period_payoff = player.group.p2_period_payoff,
-                    p1_round_payoff = p1.round_payoff,
-                    p2_round_payoff = p2.round_payoff,
-                    expected = player.timestamp + period_length,
-                    next_period_length = period_length
-                    )}
+            elif partner.ready and group.supergame_started and not server_scheduler and me.period <= num_periods and me.period <= partner.period: 
+                response = {player.id_in_group: period_message('start-period', group, me.timestamp + period_length, period_length,
+                                                                broadcast=False)}
             # else do nothing and wait
 
+        # with the server scheduler, keep the latest choice for the end of the period
+        if data['type'] == 'action':
+            me.next_action = float(data['action'])
+
         # if a client sends an update save it to the player variable
         if data['type'] == 'update':
-            player.period = player.period + 1
-            player.action = data['action']
-            player.timestamp = timestamp
+            me.period = me.period + 1
+            me.action = data['action']
+            me.timestamp = timestamp
+            group.timing.update(player.id_in_group, timestamp - data['expected'])
 
             # if partner's action has arrived, calculate payoffs, copy data to group variable, save observation and 
             # send information to everyone in group
-            if player.period == partner.period:
-                if player.period < num_periods:
-                    type = 'start-period'
-                else:
-                    type = 'end-supergame'
-
-                # update group fields and calculate payoffs
-                player.group.period = player.period
-                for p in player.group.get_players():
-                    partner = p.get_others_in_group()[0]
-                    p.period_payoff = payoff_function('payoff', p, partner)
-                    p.round_payoff += p.period_payoff
-                    p.period_fitness = payoff_function('fitness', p, partner)
-                    p.round_fitness += p.period_fitness
-
-                player.group.expected_timestamp = data['expected']
-                update_group_vars(player.group)
-                for p in player.group.get_players():
-                    save_period(p)
-
+            if me.period == partner.period:
+                group.period = me.period
+                group.expected_timestamp = data['expected']
                 # adjust period length for last period's bias
-                dt = timestamp - data['expected']
-                next_period_length = max(period_length - player.max_adjustment, period_length - dt)
-
-                return {0: dict(
-                    type = type,
-                    period = player.group.period,
-                    p1_action = player.group.p1_action,
-                    p2_action = player.group.p2_action,
-                    p1_period_payoff = player.group.p1_period_payoff,
-                    p2_period_payoff = player.group.p2_period_payoff,
-                    p1_round_payoff = p1.round_payoff,
-                    p2_round_payoff = p2.round_payoff,
-                    expected = timestamp + next_period_length,
-                    next_period_length = next_period_length
-                    )}
+                type, next_period_length = close_period(group, timestamp - data['expected'])
+
+                finished = type == 'end-supergame'
+                response = {0: period_message(type, group, timestamp + next_period_length, next_period_length)}
+
+        # the group is written back whenever the server answers: at the start of the supergame, at the end of every period
+        # and when a reloaded page is brought back into the period. a ready, an action or the first update of a period
+        # only change the group state until then
+        group.timing.message(data['type'], (time.perf_counter() - start) * 1000)
+        if finished:
+            finish_supergame(group, player.group)
+        elif response is not None:
+            group.flush(player.group)
+        return response
+
+    # leaving the page is a safe point to write what the group state still holds
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        group = cached_group_state(player.group)
+        if group is not None:
+            group.flush(player.group)
+            flush_observations(group)
 
 
 class ResultsWaitPage(WaitPage):
     # on this page convert the points from the previous supergame to Euro
     wait_for_all_groups = True
     def after_all_players_arrive(subsession):
-        update_confidence(subsession)
-        for p in subsession.get_players():
-            p.participant.total_payoff += p.round_payoff
-            p.payoff = p.round_payoff / p.session.config['conversion_rate']
+        # the groups wrote their supergame when it ended (finish_supergame), in the process that served them.
+        # a group state this process still has (a page reloaded after the end) can only hold unwritten observations
+        groups = subsession.get_groups()
+        for group in groups:
+            scheduler.cancel(group.id)
+            state = cached_group_state(group)
+            if state is not None:
+                flush_observations(state)
+        drop_group_states(groups)
+        end_supergame(subsession)
+
+    def is_displayed(player):
+        return not fast_forwarded(player.session)
 
 
 class Results(Page):
     timeout_seconds = 5
     #def is_displayed(player):
     #    return player.session.config['simulation'] == False
+    def is_displayed(player):
+        return not fast_forwarded(player.session)
     
     @staticmethod
     def vars_for_template(player: Player):
@@ -304,75 +332,83 @@ class Results(Page):
 page_sequence = [Instructions, SetupWaitPage, Decision, ResultsWaitPage, Results]
 
 
+# timing and desync of the live periods per group (see timing.py). finished supergames are read from Timings,
+# the supergame that is running from the group states of this process (with lab_router.py only the groups that
+# are served by the first process)
+def vars_for_admin_report(subsession):
+    groups = subsession.get_groups()
+    id_in_subsession = {g.id: g.id_in_subsession for g in groups}
+    timings = {id_in_subsession[row.group_id]: GroupTiming.from_row(row) for row in Timings.filter(subsession=subsession)}
+    for g in groups:
+        state = cached_group_state(g)
+        if state is not None:
+            timings[g.id_in_subsession] = state.timing
+    return timing_report(timings)
+
+
 # FUNCTIONS
+_schedules = {} # session code -> TreatmentSchedule
+
+
+# the treatment schedule of a session, as parsed when the session was created. it is built once per session and
+# process, the pages then read it without going through the stored configs again
+def session_schedule(session):
+    schedule = _schedules.get(session.code)
+    if schedule is None:
+        schedule = _schedules[session.code] = TreatmentSchedule(session.treatment_configs, session.config['treatment_file'])
+    return schedule
+
+
 def creating_session(subsession: Subsession):
-    # read the config file first read the config
-    path = 'evolving_managers/config/'+subsession.session.config['treatment_file']
-    with open(path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        configs = [row for row in reader]
-    
-    # adjust data formats
-    for row in configs:
-        row['start_supergame'] = int(row['start_supergame'])
-        row['end_supergame'] = int(row['end_supergame'])
-        row['num_periods'] = int(row['num_periods'])
-        row['gamma'] = float(row['gamma'])
-        row['joint_payoff_info'] = row['joint_payoff_info'] == 'True'
-        row['relative_payoff_info'] = row['relative_payoff_info'] == 'True'
-        row['population_size'] = int(row['population_size'])
-        row['initial_confidence_lower'] = float(row['initial_confidence_lower'])
-        row['initial_confidence_upper'] = float(row['initial_confidence_upper'])
-        row['mseconds_per_period'] = int(row['mseconds_per_period'])
-        row['max_adjustment'] = int(row['max_adjustment'])
-        row['treatment_id'] = int(row['treatment_id'])
-
-    # save it in a participant variable in case we ever need it
+    # the treatment file in evolving_managers/config is parsed and validated once, in round 1, and its configs are
+    # kept in the session. all rounds and pages read them from there (session_schedule), so editing the file while
+    # the session runs does not change it
     if subsession.round_number == 1:
-        for p in subsession.get_players():
-            p.participant.configs = configs
+        schedule = load_schedule(subsession.session.config['treatment_file'])
+        if schedule.num_rounds < C.NUM_ROUNDS:
+            raise ValueError(f'{schedule.name} only covers {schedule.num_rounds} of {C.NUM_ROUNDS} supergames')
+        subsession.session.treatment_configs = [dict(config) for config in schedule.configs]
+    schedule = session_schedule(subsession.session)
+    if subsession.round_number == 1 and fast_forwarded(subsession.session) and not subsession.session.config['simulation']:
+        raise ValueError('fast_forward needs simulation = True, without browsers nobody chooses the actions')
 
     # grab the current config
-    current_config = [config for config in configs if config['start_supergame'] <= subsession.round_number and config['end_supergame'] >= subsession.round_number][0]
+    current_config = schedule[subsession.round_number]
 
-    # in round 1, assign a player to a population
+    # in round 1, assign a player to a population. the populations are indexed once in the session (participant ids
+    # by population, in the order of id_in_session) and every round looks its players up in that index
+    session = subsession.session
     if subsession.round_number == 1:
-        for p in subsession.get_players():
-            p.participant.population = (p.participant.id_in_session - 1) // current_config['population_size'] + 1
-            p.participant.total_payoff = 0
-    
+        # all draws of the session (initial confidences, matching, initial actions, evolution) come from streams
+        # keyed by this seed, so lab_replay.py can reproduce the session. session.config['seed'] fixes it
+        session.seed = str(session.config.get('seed') or random.randrange(2**32))
+        session.populations = {}
+        session.initial_population_confidence = {}
+        for pp in session.get_participants():
+            pp.population = (pp.id_in_session - 1) // current_config['population_size'] + 1
+            pp.total_payoff = 0
+            session.populations.setdefault(pp.population, []).append(pp.id)
+
     # shuffle the matching within each population every round and assign initial confidence
-    players = subsession.get_players()
-    for p in players:
-        p.population = p.participant.population
-    num_populations = max([p.population for p in players])
+    subsession.seed = session.seed
+    players = {p.participant_id: p for p in subsession.get_players()}
     new_group_matrix = []
-    i = 1
-    
-    while i <= num_populations:
-        population = [p for p in players if p.population == i]
+    for i, participant_ids in session.populations.items():
+        population = [players[participant_id] for participant_id in participant_ids]
         # if the current round is the first round in a treatment (when doing within-subjects treatments)
-        # assign initial confidence, else grab confidence from first round of current treatment
+        # assign initial confidence, else keep the one of the first round of current treatment from the session's table
         # alternate populations' initial confidence
         if subsession.round_number == current_config['start_supergame']:
-            if i % 2 == current_config['treatment_id'] % 2:
-                confidence = current_config['initial_confidence_lower']
-            else:
-                confidence = current_config['initial_confidence_upper']
+            session.initial_population_confidence[i] = population_confidence(current_config, i)
+            rng = keyed_random(session.seed, subsession.round_number, i, 'confidence')
             for p in population:
-                p.confidence = confidence + random.uniform(-C.NOISE_RANGE/2, C.NOISE_RANGE/2)
-                p.initial_population_confidence = confidence
-        else:
-            for p in population:
-                p.initial_population_confidence = p.in_round(current_config['start_supergame']).initial_population_confidence
-
-        random.shuffle(population)
-        j = 0
-        while j < len(population):
-            new_group = [population[j], population[j+1]]
-            new_group_matrix.append(new_group)
-            j += 2
-        i += 1        
+                p.confidence = session.initial_population_confidence[i] + rng.uniform(-C.NOISE_RANGE/2, C.NOISE_RANGE/2)
+        for p in population:
+            p.population = i
+            p.initial_population_confidence = session.initial_population_confidence[i]
+
+        keyed_random(session.seed, subsession.round_number, i, 'matching').shuffle(population)
+        new_group_matrix += [population[j:j+2] for j in range(0, len(population), 2)]
     subsession.set_group_matrix(new_group_matrix)
 
     # set parameters for all groups
@@ -382,17 +418,106 @@ def creating_session(subsession: Subsession):
         g.session_config = subsession.session.config['treatment_file']
 
     # draw player's initial action and assign treatment variables
-    for p in subsession.get_players():
-        p.population = p.participant.population
-        p.action = draw_initial_action()
+    rng = keyed_random(session.seed, subsession.round_number, 'action')
+    for p in players.values():
+        p.action = draw_initial_action(rng)
         p.joint_payoff_info = current_config['joint_payoff_info']
         p.relative_payoff_info = current_config['relative_payoff_info']
         p.mseconds_per_period = current_config['mseconds_per_period']
         p.max_adjustment = current_config['max_adjustment']
 
+    # all rounds are set up now, play the whole session
+    if subsession.round_number == C.NUM_ROUNDS and fast_forwarded(session):
+        fast_forward(subsession)
+
+
+# calculate the payoff and fitness for the first period (which is not paid) and save it
+# timestamp is when in milliseconds, now unless fast_forward passes its virtual clock
+def start_supergame(subsession, timestamp=None):
+    if timestamp is None:
+        timestamp = time.time() * 1000
+    for group, players in groups_with_players(subsession):
+        for p in players:
+            p.timestamp = timestamp
+            partner = players[2 - p.id_in_group]
+            p.period_payoff = payoff_function('payoff', p, partner)
+            p.period_fitness = payoff_function('fitness', p, partner)
+
+        # if we are running a simulation, let managers play Nash in all rounds
+        if p.session.config['simulation'] == True:
+            for p in players:
+                partner = players[2 - p.id_in_group]
+                p.action = (2*p.confidence - p.group.gamma*partner.confidence)/(4-p.group.gamma*p.group.gamma)
+            for p in players:
+                partner = players[2 - p.id_in_group]
+                p.period_payoff = payoff_function('payoff', p, partner)
+                p.period_fitness = payoff_function('fitness', p, partner)
 
-def draw_initial_action():
-    action = round(random.random(),C.ACTION_DECIMAL_PLACES)
+        update_group_vars(group) # use this function to update all the group values after the player variables have all been set
+        group.expected_timestamp = max([p.timestamp for p in players])
+
+        for p in players:
+            save_period(p) # save data for all players
+
+
+# pay the supergame and evolve the confidences for the next one
+def end_supergame(subsession):
+    update_confidence(subsession)
+    for p in subsession.get_players():
+        p.participant.total_payoff += p.round_payoff
+        p.payoff = p.round_payoff / p.session.config['conversion_rate']
+
+
+# the groups of the subsession with their players ordered by id_in_group, in two queries instead of one per group
+def groups_with_players(subsession):
+    players = {}
+    for p in subsession.get_players():
+        players.setdefault(p.group_id, []).append(p)
+    return [(g, sorted(players[g.id], key=lambda p: p.id_in_group)) for g in subsession.get_groups()]
+
+
+def fast_forwarded(session):
+    return session.config.get('fast_forward', False)
+
+
+# with session.config['fast_forward'] (only for simulation sessions) the whole session is played when it is created:
+# once creating_session has set up the last supergame, every supergame is started, played and ended on the server like
+# on the pages (start_supergame, close_period, end_supergame), with the Nash actions of the simulation and a virtual
+# clock of mseconds_per_period per period. the pages of evolving_managers are skipped, the participants start at the
+# questionnaire. takes seconds instead of hours, for smoke tests of treatment files and reference datasets.
+# all timestamps come from the virtual clock, which starts at the creation of the session and only moves forward:
+# a supergame starts when the one before has ended plus the time of the Results page
+def fast_forward(last_subsession):
+    clock = time.time() * 1000
+    for subsession in last_subsession.in_all_rounds():
+        start_supergame(subsession, clock)
+        end = clock
+        for group, group_players in groups_with_players(subsession):
+            # the same in-process state the live page uses, but never cached
+            state = GroupState(group, group_players)
+            state.supergame_started = True
+            period_length = group_players[0].mseconds_per_period
+            timestamp = clock
+            while state.period < state.num_periods:
+                timestamp += period_length
+                for p in state.get_players():
+                    p.ready = True
+                    p.period = p.period + 1
+                    p.timestamp = timestamp
+                state.period = state.period + 1
+                state.expected_timestamp = timestamp
+                close_period(state, 0)
+            state.flush_group(group)
+            for p in group_players:
+                state.flush_player(p)
+            flush_observations(state)
+            end = max(end, timestamp)
+        end_supergame(subsession)
+        clock = end + Results.timeout_seconds * 1000
+
+
+def draw_initial_action(rng=random):
+    action = round(rng.random(),C.ACTION_DECIMAL_PLACES)
     return action
 
 
@@ -412,63 +537,130 @@ def update_group_vars(group):
     group.p2_period_payoff = p2.period_payoff
 
 
+# the period the group is in is over and the players' actions are set: calculate payoffs, copy data to group variables
+# and save the observations. dt is how late the period ended, the next period is shortened by it, but by at most
+# max_adjustment. returns the type of the next message and the length of the next period
+def close_period(group, dt):
+    for p in group.get_players():
+        p_partner = group.partner(p)
+        p.period_payoff = payoff_function('payoff', p, p_partner)
+        p.round_payoff += p.period_payoff
+        p.period_fitness = payoff_function('fitness', p, p_partner)
+        p.round_fitness += p.period_fitness
+    update_group_vars(group)
+    for p in group.get_players():
+        buffer_period(group, p)
+
+    p1 = group.get_player_by_id(1)
+    period_length = p1.mseconds_per_period
+    next_period_length = max(period_length - p1.max_adjustment, period_length - dt)
+    group.timing.adjustment(period_length - next_period_length, dt > p1.max_adjustment)
+    if group.period < group.num_periods:
+        return 'start-period', next_period_length
+    return 'end-supergame', next_period_length
+
+
+# the supergame of the group is over: write its players, observations and timings and forget its state.
+# this happens in the process that served the group's live messages, which (with lab_router.py) need not be
+# the one that serves the pages
+def finish_supergame(group_state, group):
+    group_state.flush(group)
+    flush_observations(group_state)
+    Timings.create(subsession_id=group.subsession_id, group_id=group.id, supergame=group.round_number, **group_state.timing.row())
+    drop_group_states([group])
+
+
+# called by the server scheduler when the current period of a group is over, returns the messages for the live pages
+def end_period(group_id):
+    group = cached_group_state_by_id(group_id)
+    if group is None or group.period >= group.num_periods:
+        return []
+    timestamp = time.time() * 1000
+    for p in group.get_players():
+        p.period = p.period + 1
+        p.timestamp = timestamp
+        if p.next_action is not None:
+            p.action = p.next_action
+            p.next_action = None
+    group.period = group.period + 1
+    group.expected_timestamp = group.period_end
+    group.timing.server_update(timestamp - group.period_end)
+    type, next_period_length = close_period(group, timestamp - group.period_end)
+    # the message counts in the group's sequence, so it is made before the group is written
+    message = period_message(type, group, timestamp + next_period_length, next_period_length)
+    if type == 'start-period':
+        group.period_end = timestamp + next_period_length
+        scheduler.schedule(group_id, next_period_length, end_period)
+        group.flush(Group.objects_get(id=group_id))
+    else:
+        finish_supergame(group, Group.objects_get(id=group_id))
+    return [(channel, message) for channel in group.channels.values()]
+
+
 # the core function of the study
 def update_confidence(subsession):
     players = subsession.get_players()
-    num_populations = max([p.population for p in players])
-    i = 1
-    while i <= num_populations:
-        population = [p for p in players if i == p.population]
-        pop_fitness = [p.round_fitness for p in population]
-        avg_pop_fitness = sum(pop_fitness)/len(pop_fitness)
-        # the chance to select one's manager increases linearly from the best-performing (in terms of fitness/profits) to the worst-performing firm
-        for p in population:
-            p.rank = sum([p.round_fitness < f for f in pop_fitness])
-            p.weight = max(0, p.round_fitness - avg_pop_fitness)
-        for r in range(len(population)):
-            equal_rank = [p for p in population if p.rank == r]
-            if len(equal_rank) > 1:
-                tiebreaker = list(range(len(equal_rank))) # randomly break ties in ranks
-                random.shuffle(tiebreaker)
-                for e in range(len(equal_rank)):
-                    equal_rank[e].rank = equal_rank[e].rank + tiebreaker[e]
-        for p in population:
-            p.prob_selection = p.rank/(len(population) - 1)
-        
-        # if a firm wants a new manager, they choose a target from firms beating the average in the population, weighted by the distance to the average.
-        if all(p.weight == 0 for p in population):
-            for p in population:
-                p.weight = 1
-        weightsum = sum([p.weight for p in population])
-        for p in population:
-            p.prob_imitation_target = p.weight/weightsum
-        
-        # randomly draw if a firm selects their manager. if they do, add a random uniform error in the target's confidence
-        for p in population:
-            current_config = [config for config in p.participant.configs if config['start_supergame'] <= p.round_number and config['end_supergame'] >= p.round_number][0]
-            if random.random() > p.prob_selection:
-                p.selected = False
-                next_confidence = p.confidence
-            else:
-                p.selected = True
-                imitation_target = random.choices(population, [pl.prob_imitation_target for pl in population])[0]
-                p.imitation_target = imitation_target.participant.id_in_session
-                next_confidence = imitation_target.confidence + random.uniform(-C.NOISE_RANGE/2, C.NOISE_RANGE/2)
-                if next_confidence > C.MAX_CONFIDENCE:
-                    next_confidence = C.MAX_CONFIDENCE
-                elif next_confidence < C.MIN_CONFIDENCE:
-                    next_confidence = C.MIN_CONFIDENCE
+    current_config = session_schedule(subsession.session)[subsession.round_number]
+    # one query each for the participants and, unless this is the last supergame of the treatment, the next round's players
+    id_in_session = {pp.id: pp.id_in_session for pp in subsession.session.get_participants()}
+    if subsession.round_number != current_config['end_supergame']:
+        next_players = {p.participant_id: p for p in subsession.in_round(subsession.round_number+1).get_players()}
+    else:
+        next_players = None
+    populations = {}
+    for p in players:
+        populations.setdefault(p.population, []).append(p)
+
+    # the chance to select one's manager increases linearly from the best-performing (in terms of fitness/profits) to the worst-performing firm.
+    # if a firm selects, it imitates a firm beating the average in the population, weighted by the distance to the average,
+    # plus a random uniform error in the target's confidence (see lab_protocol.evolve_population)
+    for i, population in populations.items():
+        evolution = evolve_population([p.round_fitness for p in population], [p.confidence for p in population],
+                                      C.NOISE_RANGE, C.MIN_CONFIDENCE, C.MAX_CONFIDENCE,
+                                      keyed_random(subsession.seed, subsession.round_number, i, 'evolution'))
+        for k, p in enumerate(population):
+            p.rank = evolution['rank'][k]
+            p.prob_selection = evolution['prob_selection'][k]
+            p.weight = evolution['weight'][k]
+            p.prob_imitation_target = evolution['prob_imitation_target'][k]
+            p.selected = evolution['selected'][k]
+            if p.selected:
+                p.imitation_target = id_in_session[population[evolution['imitation_target'][k]].participant_id]
             # only update if we are not in the last supergame
-            if subsession.round_number != current_config['end_supergame'] :
-                p.in_round(subsession.round_number+1).confidence = next_confidence
-        
-        i += 1
+            if next_players is not None:
+                next_players[p.participant_id].confidence = evolution['next_confidence'][k]
+
+
+# message that starts a period or ends the supergame, sent to the clients of the group, in the compact format of lab_protocol.
+# only messages to both clients count in the group's sequence. a message to one client (a reloaded page) repeats the
+# number of the last one, so the partner sees no gap
+def period_message(type, group, expected, next_period_length, broadcast=True):
+    if broadcast:
+        group.message_seq += 1
+    return encode_message(
+        group.message_seq,
+        type,
+        group.period,
+        group.p1_action,
+        group.p2_action,
+        group.p1_period_payoff,
+        group.p2_period_payoff,
+        group.get_player_by_id(1).round_payoff,
+        group.get_player_by_id(2).round_payoff,
+        expected,
+        next_period_length,
+        )
 
 
+# works for Player objects and for the cached player states of group_state.py
 def save_period(player):
-    Observations.create(
-        player = player,
-        group = player.group,
+    Observations.create(**observation_row(player))
+
+
+def observation_row(player):
+    return dict(
+        player_id = player.id,
+        group_id = player.group.id,
         supergame = player.round_number,
         period = player.group.period,
         action = player.action,
@@ -479,6 +671,21 @@ def save_period(player):
         )
 
 
+# observations are collected in the group state and written together once the buffer is full, at the end of the
+# supergame (finish_supergame) and at the safe points (leaving the Decision page, ResultsWaitPage)
+def buffer_period(group_state, player_state):
+    group_state.observations.append(observation_row(player_state))
+    if len(group_state.observations) >= C.OBSERVATION_BUFFER_SIZE:
+        flush_observations(group_state)
+
+
+def flush_observations(group_state):
+    rows = group_state.observations
+    group_state.observations = []
+    if rows:
+        db.add_all([Observations(**row) for row in rows])
+
+
 def custom_export(players):
     yield [
         'session.code', 
@@ -495,21 +702,26 @@ def custom_export(players):
         'player.timestamp',
         'player.expected_timestamp',
     ]
-    for p in players:
+    # oTree passes the players with their participant, group and session already loaded, so all observations
+    # are read in one query, ordered by player like the players, instead of one query per player.
+    # for large databases use lab_export.py, which streams them into a gzip csv without the server
+    players = {p.id: p for p in players}
+    observations = Observations.objects_filter().order_by(Observations.player_id, Observations.id)
+    for obs in observations.yield_per(C.EXPORT_CHUNK_SIZE):
+        p = players[obs.player_id]
         pp = p.participant
-        for obs in Observations.filter(player=p):
-            yield [
-                pp.session.code,
-                pp.id_in_session,
-                pp.code,
-                pp.population,
-                p.group.id_in_subsession,
-                p.id_in_group,
-                obs.supergame,
-                obs.period,
-                obs.action,
-                obs.period_payoff,
-                obs.period_fitness,
-                obs.timestamp,
-                obs.expected_timestamp,
-            ]
+        yield [
+            pp.session.code,
+            pp.id_in_session,
+            pp.code,
+            pp.population,
+            p.group.id_in_subsession,
+            p.id_in_group,
+            obs.supergame,
+            obs.period,
+            obs.action,
+            obs.period_payoff,
+            obs.period_fitness,
+            obs.timestamp,
+            obs.expected_timestamp,
+        ]
@@ -0,0 +1,97 @@
+# in-process state of the groups on the Decision page.
+# live messages are served from this state instead of the database, the ORM objects are only written at safe points:
+#   - whenever the server answers a live message (start of the supergame, end of a period, a reloaded page brought
+#     back into the period) the group and both players are written (one query for the partner)
+#   - at the end of a supergame (finish_supergame) and when the page is left (before_next_page)
+# a ready, an action or the first update of a period stay in the state until the next safe point.
+# the observations are buffered in the state and written in bulk (see flush_observations in __init__.py).
+# if a state is missing (first message of the supergame, or the server was restarted) it is loaded from the ORM,
+# so a reloaded page continues from the last period that the server answered.
+
+from .timing import GroupTiming
+
+
+PLAYER_FIELDS = ('ready', 'period', 'action', 'timestamp', 'period_payoff', 'period_fitness', 'round_payoff', 'round_fitness')
+GROUP_FIELDS = ('period', 'supergame_started', 'expected_timestamp', 'p1_action', 'p2_action', 'p1_period_payoff', 'p2_period_payoff',
+                'message_seq')
+
+_states = {} # group id -> GroupState
+
+
+class PlayerState:
+    def __init__(self, player, group_state):
+        self.id = player.id
+        self.id_in_group = player.id_in_group
+        self.round_number = player.round_number
+        self.group = group_state
+        self.confidence = player.confidence
+        self.mseconds_per_period = player.mseconds_per_period
+        self.max_adjustment = player.max_adjustment
+        for field in PLAYER_FIELDS:
+            setattr(self, field, getattr(player, field))
+        self.next_action = None # latest action sent during the period (server scheduler)
+
+
+# duck types the parts of Group and Player that payoff_function, update_group_vars and save_period use
+class GroupState:
+    def __init__(self, group, players):
+        self.id = group.id
+        self.gamma = group.gamma
+        self.num_periods = group.num_periods
+        for field in GROUP_FIELDS:
+            setattr(self, field, getattr(group, field))
+        self.players = {p.id_in_group: PlayerState(p, self) for p in players}
+        self.observations = [] # rows for Observations that are not written yet
+        self.timing = GroupTiming() # instrumentation of the live messages, see timing.py
+        self.channels = {} # id_in_group -> channel of the player's live page (server scheduler)
+        self.period_end = None # when the server ends the current period (server scheduler)
+
+    def get_players(self):
+        return [self.players[i] for i in sorted(self.players)]
+
+    def get_player_by_id(self, id_in_group):
+        return self.players[id_in_group]
+
+    def partner(self, player_state):
+        return [p for p in self.get_players() if p is not player_state][0]
+
+    def flush_player(self, player):
+        write_fields(player, self.players[player.id_in_group], PLAYER_FIELDS)
+
+    def flush_group(self, group):
+        write_fields(group, self, GROUP_FIELDS)
+
+    # writes everything, costs one query for the players of the group
+    def flush(self, group):
+        self.flush_group(group)
+        for p in group.get_players():
+            self.flush_player(p)
+
+
+def write_fields(obj, state, fields):
+    for field in fields:
+        value = getattr(state, field)
+        if getattr(obj, field) != value:
+            setattr(obj, field, value)
+
+
+def get_group_state(group):
+    state = _states.get(group.id)
+    if state is None:
+        state = _states[group.id] = GroupState(group, group.get_players())
+    return state
+
+
+# state of the group if it is currently cached, else None (the ORM is up to date)
+def cached_group_state(group):
+    return cached_group_state_by_id(group.id)
+
+
+def cached_group_state_by_id(group_id):
+    return _states.get(group_id)
+
+
+# called once nobody is on the Decision page of the subsession anymore
+def drop_group_states(groups):
+    for group in groups:
+        _states.pop(group.id, None)
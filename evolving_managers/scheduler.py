@@ -0,0 +1,51 @@
+import asyncio
+import logging
+
+from otree.channels import utils as channel_utils
+from otree.database import session_scope
+from otree.middleware import lock2
+
+# server side clock for session.config['period_scheduler'] = 'server'.
+# a period ends when a timer of the server's event loop fires, not when both clients have sent an update.
+# the callback runs like a live message: under oTree's lock and in a database session of its own, and the messages
+# it returns are sent to the live pages of the group. this relies on oTree 5 internals (the in-process channel layer,
+# the lock of the live and page requests), which is why the otree version is pinned in requirements.txt.
+
+logger = logging.getLogger(__name__)
+
+_timers = {} # group id -> asyncio.TimerHandle of the end of the current period
+
+
+# name of the channel that reaches the player's live page, liveSend of the page has to have arrived before
+def live_channel(player):
+    participant = player.participant
+    return channel_utils.live_group(participant._session_code, participant._index_in_pages, participant.code)
+
+
+# calls callback(group_id) after delay milliseconds. it returns a list of (channel, message) to send
+def schedule(group_id, delay, callback):
+    cancel(group_id)
+    loop = asyncio.get_event_loop()
+    _timers[group_id] = loop.call_later(max(0, delay) / 1000, lambda: loop.create_task(run(group_id, callback)))
+
+
+def is_scheduled(group_id):
+    return group_id in _timers
+
+
+def cancel(group_id):
+    timer = _timers.pop(group_id, None)
+    if timer is not None:
+        timer.cancel()
+
+
+async def run(group_id, callback):
+    _timers.pop(group_id, None)
+    try:
+        async with lock2:
+            with session_scope():
+                messages = callback(group_id)
+        for channel, message in messages:
+            await channel_utils.group_send(group=channel, data=message)
+    except Exception:
+        logger.exception(f'period scheduler failed for group {group_id}')
@@ -24,4 +24,6 @@ var fakedata = {
   type: 'start-period'
 };
 
-liveRecv(fakedata);
\ No newline at end of file
+// the server sends [version, sequence number, type, values of js_vars.message_fields] (see lab_protocol.py)
+liveRecv([js_vars.live_protocol, last_seq + 1, js_vars.message_types.indexOf(fakedata.type)]
+    .concat(js_vars.message_fields.map(field => fakedata[field])));
\ No newline at end of file
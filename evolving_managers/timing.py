@@ -0,0 +1,144 @@
+import bisect
+import json
+
+# instrumentation of the live periods, collected per group next to the group state (see group_state.py):
+#   - how long live_method takes to handle a message
+#   - drift: how late (positive) or early (negative) an update arrives compared to the expected timestamp
+#     (with the server scheduler: how late the timer that ends the period fired)
+#   - correction: by how much the next period is shortened for the drift, and how often max_adjustment capped it
+#   - how many messages of each type ('ready', 'update', 'action') arrived and how many updates of each player were late
+# at the end of the supergame the numbers are written to Timings, one row per group, which the admin report
+# and lab_export.py read.
+
+# upper bounds of the histogram buckets in milliseconds, the last bucket holds everything above
+HANDLING_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+DRIFT_BUCKETS = (-200, -100, -50, -20, 0, 20, 50, 100, 200, 500, 1000)
+CORRECTION_BUCKETS = (-100, -50, -20, 0, 20, 50, 100, 200, 500, 1000)
+LATE_MSECONDS = 100 # an update that arrives later than this after the expected timestamp counts as late
+
+
+def bucket_labels(bounds):
+    return [f'<= {b}' for b in bounds] + [f'> {bounds[-1]}']
+
+
+def add(histogram, bounds, value):
+    histogram[bisect.bisect_left(bounds, value)] += 1
+
+
+class GroupTiming:
+    def __init__(self):
+        self.ready_messages = 0
+        self.update_messages = 0
+        self.action_messages = 0 # choices sent to the server scheduler
+        self.handling_total = 0.0
+        self.handling_max = 0.0
+        self.handling = [0] * (len(HANDLING_BUCKETS) + 1)
+        self.drift = [0] * (len(DRIFT_BUCKETS) + 1)
+        self.correction = [0] * (len(CORRECTION_BUCKETS) + 1)
+        self.late_p1 = 0
+        self.late_p2 = 0
+        self.clamped = 0
+
+    @property
+    def messages(self):
+        return self.ready_messages + self.update_messages + self.action_messages
+
+    def message(self, type, mseconds):
+        if type == 'ready':
+            self.ready_messages += 1
+        elif type == 'update':
+            self.update_messages += 1
+        elif type == 'action':
+            self.action_messages += 1
+        self.handling_total += mseconds
+        self.handling_max = max(self.handling_max, mseconds)
+        add(self.handling, HANDLING_BUCKETS, mseconds)
+
+    def update(self, id_in_group, drift):
+        add(self.drift, DRIFT_BUCKETS, drift)
+        if drift > LATE_MSECONDS:
+            if id_in_group == 1:
+                self.late_p1 += 1
+            else:
+                self.late_p2 += 1
+
+    # drift of a period the server ended, how late its timer fired
+    def server_update(self, drift):
+        add(self.drift, DRIFT_BUCKETS, drift)
+
+    def adjustment(self, correction, clamped):
+        add(self.correction, CORRECTION_BUCKETS, correction)
+        if clamped:
+            self.clamped += 1
+
+    # fields of a Timings row
+    def row(self):
+        return dict(
+            ready_messages = self.ready_messages,
+            update_messages = self.update_messages,
+            action_messages = self.action_messages,
+            handling_mean = self.handling_total / self.messages if self.messages else 0.0,
+            handling_max = self.handling_max,
+            handling_histogram = json.dumps(self.handling),
+            drift_histogram = json.dumps(self.drift),
+            correction_histogram = json.dumps(self.correction),
+            late_p1 = self.late_p1,
+            late_p2 = self.late_p2,
+            clamped = self.clamped,
+            )
+
+    @classmethod
+    def from_row(cls, row):
+        timing = cls()
+        timing.ready_messages = row.ready_messages
+        timing.update_messages = row.update_messages
+        timing.action_messages = row.action_messages or 0 # not recorded before the field existed
+        timing.handling_total = row.handling_mean * timing.messages
+        timing.handling_max = row.handling_max
+        timing.handling = json.loads(row.handling_histogram)
+        timing.drift = json.loads(row.drift_histogram)
+        timing.correction = json.loads(row.correction_histogram)
+        timing.late_p1 = row.late_p1
+        timing.late_p2 = row.late_p2
+        timing.clamped = row.clamped
+        return timing
+
+    def merge(self, other):
+        self.ready_messages += other.ready_messages
+        self.update_messages += other.update_messages
+        self.action_messages += other.action_messages
+        self.handling_total += other.handling_total
+        self.handling_max = max(self.handling_max, other.handling_max)
+        self.handling = [a + b for a, b in zip(self.handling, other.handling)]
+        self.drift = [a + b for a, b in zip(self.drift, other.drift)]
+        self.correction = [a + b for a, b in zip(self.correction, other.correction)]
+        self.late_p1 += other.late_p1
+        self.late_p2 += other.late_p2
+        self.clamped += other.clamped
+
+
+# tables for the admin report: one row per group and the histograms summed over the groups
+def timing_report(timings):
+    total = GroupTiming()
+    groups = []
+    for id_in_subsession, timing in sorted(timings.items()):
+        total.merge(timing)
+        groups.append(dict(
+            id_in_subsession = id_in_subsession,
+            messages = timing.messages,
+            handling_mean = round(timing.handling_total / timing.messages, 2) if timing.messages else 0,
+            handling_max = round(timing.handling_max, 2),
+            late_p1 = timing.late_p1,
+            late_p2 = timing.late_p2,
+            clamped = timing.clamped,
+            ))
+    return dict(
+        timing_groups = groups,
+        timing_messages = total.messages,
+        timing_late = total.late_p1 + total.late_p2,
+        timing_clamped = total.clamped,
+        handling_histogram = list(zip(bucket_labels(HANDLING_BUCKETS), total.handling)),
+        drift_histogram = list(zip(bucket_labels(DRIFT_BUCKETS), total.drift)),
+        correction_histogram = list(zip(bucket_labels(CORRECTION_BUCKETS), total.correction)),
+        late_mseconds = LATE_MSECONDS,
+        )
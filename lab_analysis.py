@@ -0,0 +1,295 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+# analysis of the Observations of the lab app (evolving_managers). an export is loaded once into one array per
+# column and everything is computed on the arrays, grouped with np.unique and summed with np.bincount:
+#   - partner's action and confidence of every observation, the Nash action (2a_i - gamma*a_j)/(4 - gamma^2) and
+#     the deviation of the action from it
+#   - desync of every observation, timestamp - expected_timestamp
+#   - summaries per session, population or supergame, and the confidence paths of the populations
+# sources are
+#   - a directory written by lab_export.py --format npy, read memory mapped
+#   - a csv (or .csv.gz) written by lab_export.py. the custom export of the admin interface has no confidences
+#     and gamma, the Nash actions need them
+#   - a database url, the observations are read with lab_export.py
+# csv files and databases are parsed once and kept in cache_dir in the npy format of lab_export.py, keyed by the
+# file's size and modification time or by the number, last id and last timestamp of the database's observations,
+# so a database that was reset and filled again gets new arrays.
+# period 0 is set up by the server before the live periods (SetupWaitPage), it is left out of deviations and desync.
+
+CACHE_DIR = os.getenv('LAB_ANALYSIS_CACHE', '.lab_analysis_cache')
+METADATA_FILE = 'metadata.json'
+LATE_MSECONDS = 100 # like evolving_managers/timing.py, an update more than this late counts as late
+LEVELS = ('session', 'population', 'supergame')
+
+# export column -> name in SessionData
+NAMES = {
+    'session.code': 'session',
+    'participant.id_in_session': 'participant',
+    'participant.code': 'participant_code',
+    'player.population': 'population',
+    'group.id_in_subsession': 'group',
+    'player.id_in_group': 'id_in_group',
+    'subsession.round_number': 'supergame',
+    'player.period': 'period',
+    'player.action': 'action',
+    'player.period_payoff': 'period_payoff',
+    'player.period_fitness': 'period_fitness',
+    'player.timestamp': 'timestamp',
+    'player.expected_timestamp': 'expected_timestamp',
+    'player.confidence': 'confidence',
+    'group.gamma': 'gamma',
+    'player.joint_payoff_info': 'joint_payoff_info',
+    'player.relative_payoff_info': 'relative_payoff_info',
+}
+REQUIRED = ('session', 'population', 'group', 'id_in_group', 'supergame', 'period', 'action', 'timestamp',
+            'expected_timestamp', 'confidence', 'gamma')
+STRING_COLUMNS = ('session.code', 'participant.code')
+BOOL_COLUMNS = ('player.joint_payoff_info', 'player.relative_payoff_info')
+INT_COLUMNS = ('participant.id_in_session', 'player.population', 'group.id_in_subsession', 'player.id_in_group',
+               'subsession.round_number', 'player.period')
+
+
+# the columns of an export plus the derived arrays, one entry per observation
+class SessionData:
+    def __init__(self, columns):
+        for header, name in NAMES.items():
+            if header in columns:
+                setattr(self, name, columns[header])
+        missing = [name for name in REQUIRED if not hasattr(self, name)]
+        if missing:
+            raise ValueError(f'the export has no {", ".join(missing)} (export it with lab_export.py)')
+        self.size = len(self.action)
+        self.partner = partner_index(self)
+        paired = self.partner >= 0
+        self.partner_action = np.where(paired, self.action[self.partner], np.nan)
+        self.partner_confidence = np.where(paired, self.confidence[self.partner], np.nan)
+        self.nash_action = (2*self.confidence - self.gamma*self.partner_confidence)/(4 - self.gamma*self.gamma)
+        self.deviation = self.action - self.nash_action
+        self.desync = self.timestamp - self.expected_timestamp
+        self.live = self.period > 0
+
+    def sessions(self):
+        return np.unique(self.session)
+
+
+# index of the partner's observation of the same period, -1 if it is missing. the observations are sorted by
+# session, supergame, group, period and id_in_group, so partners are neighbours
+def partner_index(data):
+    order = np.lexsort((data.id_in_group, data.period, data.group, data.supergame, data.session))
+    keys = (data.session, data.supergame, data.group, data.period)
+    same = np.ones(len(order) - 1 if len(order) else 0, dtype=bool)
+    for key in keys:
+        sorted_key = key[order]
+        same &= sorted_key[1:] == sorted_key[:-1]
+    partner = np.full(len(order), -1)
+    first = order[:-1][same]
+    second = order[1:][same]
+    partner[first] = second
+    partner[second] = first
+    return partner
+
+
+# groups of the rows by the given key arrays: the unique keys (one array per key) and the group of every row
+def group_rows(*keys):
+    records = np.rec.fromarrays(keys)
+    unique, inverse = np.unique(records, return_inverse=True)
+    return [unique[name] for name in unique.dtype.names], inverse.reshape(-1)
+
+
+def group_mean(inverse, values, count):
+    return np.bincount(inverse, weights=values, minlength=len(count)) / np.maximum(count, 1)
+
+
+def group_sd(inverse, values, count, mean):
+    squares = np.bincount(inverse, weights=values*values, minlength=len(count)) / np.maximum(count, 1)
+    variance = np.maximum(squares - mean*mean, 0) * count / np.maximum(count - 1, 1)
+    return np.sqrt(variance)
+
+
+def group_max(inverse, values, size):
+    result = np.full(size, np.nan)
+    if len(values):
+        order = np.argsort(inverse, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+        result[inverse[order][starts]] = np.maximum.reduceat(values[order], starts)
+    return result
+
+
+def key_arrays(data, level):
+    if level not in LEVELS:
+        raise ValueError('unknown level ' + repr(level) + ', options are ' + repr(LEVELS))
+    keys = [data.session]
+    if level in ('population', 'supergame'):
+        keys.append(data.population)
+    if level == 'supergame':
+        keys.append(data.supergame)
+    return keys
+
+
+# one row per session, population (of a session) or supergame (of a population) over the live periods.
+# returns a dict of columns
+def summarize(data, level='population', late=LATE_MSECONDS):
+    live = data.live
+    keys, inverse = group_rows(*[key[live] for key in key_arrays(data, level)])
+    count = np.bincount(inverse, minlength=len(keys[0])).astype(float)
+    paired = ~np.isnan(data.deviation[live])
+    paired_count = np.bincount(inverse[paired], minlength=len(count)).astype(float)
+    deviation = data.deviation[live][paired]
+    desync = data.desync[live]
+    deviation_mean = group_mean(inverse[paired], deviation, paired_count)
+    desync_mean = group_mean(inverse, desync, count)
+    summary = dict(zip(LEVELS, keys))
+    summary.update(
+        observations = count.astype(int),
+        action_mean = group_mean(inverse, data.action[live], count),
+        nash_action_mean = group_mean(inverse[paired], data.nash_action[live][paired], paired_count),
+        deviation_mean = deviation_mean,
+        deviation_sd = group_sd(inverse[paired], deviation, paired_count, deviation_mean),
+        deviation_abs_mean = group_mean(inverse[paired], np.abs(deviation), paired_count),
+        confidence_mean = group_mean(inverse, data.confidence[live], count),
+        desync_mean = desync_mean,
+        desync_sd = group_sd(inverse, desync, count, desync_mean),
+        desync_max = group_max(inverse, desync, len(count)),
+        late_share = group_mean(inverse, (desync > late).astype(float), count),
+        )
+    if hasattr(data, 'period_fitness'):
+        summary['fitness_mean'] = group_mean(inverse, data.period_fitness[live], count)
+    return summary
+
+
+# confidence of the managers of every population over the supergames: one row per session, population and
+# supergame with mean, sd, min and max over the players (every player counts once per supergame)
+def confidence_paths(data):
+    players, first = np.unique(np.rec.fromarrays((data.session, data.supergame, data.population, data.group,
+                                                  data.id_in_group)), return_index=True)
+    confidence = data.confidence[first]
+    keys, inverse = group_rows(data.session[first], data.population[first], data.supergame[first])
+    count = np.bincount(inverse, minlength=len(keys[0])).astype(float)
+    mean = group_mean(inverse, confidence, count)
+    return dict(
+        session = keys[0],
+        population = keys[1],
+        supergame = keys[2],
+        players = count.astype(int),
+        confidence_mean = mean,
+        confidence_sd = group_sd(inverse, confidence, count, mean),
+        confidence_min = -group_max(inverse, -confidence, len(count)),
+        confidence_max = group_max(inverse, confidence, len(count)),
+        )
+
+
+# columns of a directory written by lab_export.py --format npy (or by the cache), memory mapped
+def read_npy(path):
+    with open(os.path.join(path, METADATA_FILE)) as metadata_file:
+        metadata = json.load(metadata_file)
+    return {header: np.load(os.path.join(path, header + '.npy'), mmap_mode='r') for header in metadata['columns']}
+
+
+def write_npy(path, columns, **metadata):
+    os.makedirs(path, exist_ok=True)
+    for header, column in columns.items():
+        np.save(os.path.join(path, header + '.npy'), column)
+    with open(os.path.join(path, METADATA_FILE), 'w') as metadata_file:
+        json.dump(dict(metadata, columns=list(columns), rows=len(next(iter(columns.values()), []))), metadata_file, indent=2)
+
+
+def read_csv(path):
+    with (gzip.open(path, 'rt', newline='') if path.endswith('.gz') else open(path, newline='')) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        values = list(zip(*reader)) or [()] * len(header)
+    columns = {}
+    for name, column in zip(header, values):
+        if name in STRING_COLUMNS:
+            columns[name] = np.array(column, dtype=str)
+        elif name in BOOL_COLUMNS:
+            columns[name] = np.array([value in ('True', 'true', '1') for value in column], dtype=bool)
+        elif name in INT_COLUMNS:
+            columns[name] = np.array(column, dtype=np.int64)
+        else:
+            columns[name] = np.array([value if value != '' else 'nan' for value in column], dtype=np.float64)
+    return columns
+
+
+def cached(cache_dir, key, parse):
+    path = os.path.join(cache_dir, hashlib.sha1(json.dumps(key).encode()).hexdigest())
+    if not os.path.exists(os.path.join(path, METADATA_FILE)):
+        partial = path + '.partial'
+        shutil.rmtree(partial, ignore_errors=True)
+        parse(partial)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(partial, path)
+    return read_npy(path)
+
+
+def load_columns(source, session_codes=None, cache_dir=CACHE_DIR):
+    if '://' in source:
+        import sqlalchemy
+        import lab_export
+
+        engine = sqlalchemy.create_engine(source)
+        try:
+            with engine.connect() as connection:
+                condition, parameters = lab_export.where(session_codes)
+                fingerprint = connection.execute(sqlalchemy.text(
+                    'SELECT COUNT(*), MAX(o.id), MAX(o.timestamp)' + lab_export.FROM + condition), parameters).first()
+                return cached(cache_dir, ['database', source, sorted(session_codes or []), list(fingerprint)],
+                              lambda path: lab_export.write_npy(connection, path, session_codes))
+        finally:
+            engine.dispose()
+    if os.path.isdir(source):
+        return read_npy(source)
+    stat = os.stat(source)
+    return cached(cache_dir, ['csv', os.path.abspath(source), stat.st_size, stat.st_mtime_ns],
+                  lambda path: write_npy(path, read_csv(source), source=source))
+
+
+# the observations of source (see above), only of the given sessions if session_codes is given
+def load(source, session_codes=None, cache_dir=CACHE_DIR):
+    columns = load_columns(source, session_codes, cache_dir)
+    if session_codes and 'session.code' in columns:
+        mask = np.isin(columns['session.code'], list(session_codes))
+        columns = {header: column[mask] for header, column in columns.items()}
+    else:
+        columns = {header: np.asarray(column) for header, column in columns.items()}
+    return SessionData(columns)
+
+
+def write_rows(columns, path):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(list(columns))
+        writer.writerows(zip(*[column.tolist() for column in columns.values()]))
+
+
+# python lab_analysis.py observations.csv.gz --level population --output populations.csv
+# python lab_analysis.py observations --confidence-paths --output paths.csv
+# python lab_analysis.py sqlite:///db.sqlite3 --session abcd1234 efgh5678 --level supergame
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='summaries of the Observations of evolving_managers')
+    parser.add_argument('source', help='npy directory or csv of lab_export.py, or a database url')
+    parser.add_argument('--session', nargs='*', help='session codes, all sessions if omitted')
+    parser.add_argument('--level', choices=LEVELS, default='population')
+    parser.add_argument('--confidence-paths', action='store_true', help='confidence per population and supergame instead')
+    parser.add_argument('--late', type=float, default=LATE_MSECONDS, help='an update this many ms late counts as late')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', default='summary.csv')
+    args = parser.parse_args()
+
+    start = time.time()
+    data = load(args.source, args.session, args.cache_dir)
+    loaded = time.time()
+    result = confidence_paths(data) if args.confidence_paths else summarize(data, args.level, args.late)
+    write_rows(result, args.output)
+    print(f'{data.size} observations of {len(data.sessions())} sessions loaded in {loaded - start:.2f} s, '
+          f'{len(next(iter(result.values())))} rows in {time.time() - loaded:.2f} s')
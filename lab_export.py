@@ -0,0 +1,178 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import time
+
+import sqlalchemy
+
+
+# exports the Observations of the lab app (evolving_managers) straight from the database, without the oTree server.
+# all observations are read in one ordered query joined with the player, participant, group and session, fetched
+# chunk_size rows at a time (a server side cursor on postgres), and written as they arrive, so memory does not grow
+# with the number of observations and the database does not have to be reset between sessions.
+#   csv     gzip compressed csv with the columns of custom_export and the treatment variables
+#   npy     a directory with one .npy file per column and metadata.json (like evolv_store), needs numpy
+# --table timings exports the timing and desync instrumentation of the live periods (Timings, see
+# evolving_managers/timing.py) instead, one row per group and supergame with the histograms as json lists (csv only)
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
+FORMATS = ('csv', 'npy')
+CHUNK_SIZE = 10000
+CODE_LENGTH = 16 # session and participant codes are stored as fixed width strings in the npy format
+
+# (header, sql expression, numpy dtype). the treatment variables are taken from the player and group,
+# save_period does not fill them in Observations
+COLUMNS = (
+    ('session.code', 's.code', 'U%d' % CODE_LENGTH),
+    ('participant.id_in_session', 'pt.id_in_session', 'int32'),
+    ('participant.code', 'pt.code', 'U%d' % CODE_LENGTH),
+    ('player.population', 'pl.population', 'int32'),
+    ('group.id_in_subsession', 'g.id_in_subsession', 'int32'),
+    ('player.id_in_group', 'pl.id_in_group', 'int8'),
+    ('subsession.round_number', 'o.supergame', 'int32'),
+    ('player.period', 'o.period', 'int32'),
+    ('player.action', 'o.action', 'float64'),
+    ('player.period_payoff', 'o.period_payoff', 'float64'),
+    ('player.period_fitness', 'o.period_fitness', 'float64'),
+    ('player.timestamp', 'o.timestamp', 'float64'),
+    ('player.expected_timestamp', 'o.expected_timestamp', 'float64'),
+    ('player.confidence', 'pl.confidence', 'float64'),
+    ('group.gamma', 'g.gamma', 'float64'),
+    ('player.joint_payoff_info', 'pl.joint_payoff_info', 'bool'),
+    ('player.relative_payoff_info', 'pl.relative_payoff_info', 'bool'),
+)
+
+FROM = '''
+    FROM evolving_managers_observations o
+    JOIN evolving_managers_player pl ON pl.id = o.player_id
+    JOIN evolving_managers_group g ON g.id = o.group_id
+    JOIN otree_participant pt ON pt.id = pl.participant_id
+    JOIN otree_session s ON s.id = pl.session_id
+'''
+
+TIMING_COLUMNS = (
+    ('session.code', 's.code', None),
+    ('subsession.round_number', 't.supergame', None),
+    ('group.id_in_subsession', 'g.id_in_subsession', None),
+    ('ready_messages', 't.ready_messages', None),
+    ('update_messages', 't.update_messages', None),
+    ('action_messages', 't.action_messages', None),
+    ('handling_mean', 't.handling_mean', None),
+    ('handling_max', 't.handling_max', None),
+    ('handling_histogram', 't.handling_histogram', None),
+    ('drift_histogram', 't.drift_histogram', None),
+    ('correction_histogram', 't.correction_histogram', None),
+    ('late_p1', 't.late_p1', None),
+    ('late_p2', 't.late_p2', None),
+    ('clamped', 't.clamped', None),
+)
+
+TIMING_FROM = '''
+    FROM evolving_managers_timings t
+    JOIN evolving_managers_group g ON g.id = t.group_id
+    JOIN otree_session s ON s.id = g.session_id
+'''
+
+# columns, FROM clause and order of every table
+TABLES = dict(
+    observations=(COLUMNS, FROM, 'o.player_id, o.id'),
+    timings=(TIMING_COLUMNS, TIMING_FROM, 't.id'),
+)
+
+
+def where(session_codes):
+    if not session_codes:
+        return '', {}
+    names = ['code%d' % i for i in range(len(session_codes))]
+    return 'WHERE s.code IN (' + ', '.join(':' + name for name in names) + ')', dict(zip(names, session_codes))
+
+
+# rows of table, chunk_size at a time. observations are in the order of custom_export (by player, then by observation)
+def observation_chunks(connection, session_codes=None, chunk_size=CHUNK_SIZE, table='observations'):
+    columns, from_clause, order = TABLES[table]
+    condition, parameters = where(session_codes)
+    query = 'SELECT ' + ', '.join(sql for _, sql, _ in columns) + from_clause + condition + ' ORDER BY ' + order
+    result = connection.execution_options(stream_results=True).execute(sqlalchemy.text(query), parameters)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def count_observations(connection, session_codes=None):
+    condition, parameters = where(session_codes)
+    return connection.execute(sqlalchemy.text('SELECT COUNT(*)' + FROM + condition), parameters).scalar()
+
+
+def write_csv(connection, path, session_codes=None, chunk_size=CHUNK_SIZE, table='observations'):
+    count = 0
+    with gzip.open(path, 'wt', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([header for header, _, _ in TABLES[table][0]])
+        for rows in observation_chunks(connection, session_codes, chunk_size, table):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+# the number of rows is queried first, so every column can be preallocated as a memory mapped .npy file
+def write_npy(connection, path, session_codes=None, chunk_size=CHUNK_SIZE):
+    import numpy as np
+
+    count = count_observations(connection, session_codes)
+    os.makedirs(path, exist_ok=True)
+    arrays = [np.lib.format.open_memmap(os.path.join(path, header + '.npy'), mode='w+', dtype=dtype, shape=(count,))
+              for header, _, dtype in COLUMNS]
+    filled = 0
+    for rows in observation_chunks(connection, session_codes, chunk_size):
+        # rows that arrived after the count are left out, the export is a snapshot
+        rows = rows[:count - filled]
+        for i, array in enumerate(arrays):
+            array[filled:filled + len(rows)] = [row[i] for row in rows]
+        filled += len(rows)
+    for array in arrays:
+        array.flush()
+    with open(os.path.join(path, 'metadata.json'), 'w') as metadata_file:
+        json.dump(dict(columns=[header for header, _, _ in COLUMNS], rows=filled, session_codes=session_codes or []),
+                  metadata_file, indent=2)
+    return filled
+
+
+def export_observations(path, session_codes=None, output_format='csv', database_url=DATABASE_URL, chunk_size=CHUNK_SIZE,
+                        table='observations'):
+    if output_format not in FORMATS:
+        raise ValueError('unknown format ' + repr(output_format) + ', options are ' + repr(FORMATS))
+    if table not in TABLES:
+        raise ValueError('unknown table ' + repr(table) + ', options are ' + repr(tuple(TABLES)))
+    if table != 'observations' and output_format != 'csv':
+        raise ValueError('only observations can be exported as npy')
+    engine = sqlalchemy.create_engine(database_url)
+    try:
+        with engine.connect() as connection:
+            if output_format == 'csv':
+                return write_csv(connection, path, session_codes, chunk_size, table)
+            return write_npy(connection, path, session_codes, chunk_size)
+    finally:
+        engine.dispose()
+
+
+# python lab_export.py observations.csv.gz --session abcd1234
+# python lab_export.py observations --format npy
+# python lab_export.py timings.csv.gz --table timings
+# the database is taken from DATABASE_URL like in oTree (db.sqlite3 in the current directory if it is not set)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='export the Observations of evolving_managers')
+    parser.add_argument('output', help='file (csv) or directory (npy)')
+    parser.add_argument('--session', nargs='*', help='session codes, all sessions if omitted')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--table', choices=tuple(TABLES), default='observations')
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    start = time.time()
+    count = export_observations(args.output, args.session, args.format, args.database_url, args.chunk_size, args.table)
+    print(f'{count} rows of {args.table} in {time.time() - start:.2f} s')
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+import websockets
+
+from lab_protocol import decode_message
+
+
+# load test of the live Decision page of evolving_managers against a running oTree server (otree devserver with
+# sqlite or otree prodserver with postgres). for every number of groups a session with simulation = True is created
+# through the REST api, the participants are walked to the Decision page over http, and every participant is played
+# by a websocket client that behaves like high-frequency.js: it sends 'ready', and after each 'start-period' waits
+# next_period_length milliseconds and replies with an 'update' with its action (the Nash action that SetupWaitPage
+# sets in simulation mode). with --scheduler server the clients only send their 'action' once per period.
+# per group it records
+#   latency  time from the later update of a period until the next message of the server arrives. with --scheduler
+#            server, time from the end of the period on the server's schedule (the 'expected' of the message that
+#            started it) until the next message arrives, this compares the server's clock with the client's
+#   drift    how much longer a period took than mseconds_per_period, from message to message
+# and the result of every session is one json line, so the lines of several runs give the throughput-latency curve.
+
+REST_KEY = os.getenv('OTREE_REST_KEY', '')
+GROUPS = (1, 2, 4, 8, 16, 32)
+
+
+def request(url, data=None):
+    headers = {'otree-rest-key': REST_KEY, 'Content-Type': 'application/json'}
+    body = json.dumps(data).encode() if data is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, body, headers)) as response:
+        return response.geturl(), response.read().decode()
+
+
+def create_session(server, session_config, num_participants, config_fields):
+    _, body = request(server + '/api/sessions', dict(
+        session_config_name=session_config,
+        num_participants=num_participants,
+        modified_session_config_fields=dict(config_fields, simulation=True),
+    ))
+    code = json.loads(body)['code']
+    _, body = request(server + '/api/sessions/' + code)
+    return code, [p['code'] for p in json.loads(body)['participants']]
+
+
+# submits the pages before the Decision page and waits on the wait pages, returns the html of the Decision page
+def advance_to_decision(server, participant_code, timeout=120):
+    url, html = request(server + '/InitializeParticipant/' + participant_code)
+    deadline = time.time() + timeout
+    while '/Decision/' not in url:
+        if time.time() > deadline:
+            raise TimeoutError(f'participant {participant_code} did not reach the Decision page, stuck at {url}')
+        if 'WaitPage' in url:
+            time.sleep(0.5)
+            url, html = request(server + '/InitializeParticipant/' + participant_code)
+        else:
+            url, html = request(url, {})
+    return html
+
+
+class Client:
+    def __init__(self, server, html, scheduler, max_periods):
+        self.socket_url = re.sub('^http', 'ws', server) + \
+            re.search(r'id="otree-live" data-socket-url="([^"]+)"', html).group(1).replace('&amp;', '&')
+        self.js_vars = json.loads(re.search(r'var js_vars = (.*?);</script>', html).group(1))
+        self.id_in_group = self.js_vars['id']
+        self.scheduler = scheduler
+        self.max_periods = max_periods
+        self.sent = {}     # period -> when the update for it was sent
+        self.scheduled = {} # period -> when the server scheduler ends it
+        self.received = {} # period -> when the message that ends it (and starts the next one) arrived
+        self.messages = 0
+        self.period_length = None # mseconds_per_period, the length of period 0
+
+    async def play(self):
+        async with websockets.connect(self.socket_url) as socket:
+            await socket.send(json.dumps(dict(type='ready')))
+            while True:
+                message = decode_message(json.loads(await socket.recv()))
+                self.received[message['period']] = time.time() * 1000
+                self.messages += 1
+                if self.period_length is None:
+                    self.period_length = message['next_period_length']
+                if message['type'] == 'end-supergame' or message['period'] >= self.max_periods:
+                    return
+                action = message[f'p{self.id_in_group}_action']
+                if self.scheduler == 'server':
+                    self.scheduled[message['period'] + 1] = message['expected']
+                    await asyncio.sleep(message['next_period_length'] / 2000)
+                    await socket.send(json.dumps(dict(type='action', action=action)))
+                else:
+                    await asyncio.sleep(message['next_period_length'] / 1000)
+                    self.sent[message['period'] + 1] = time.time() * 1000
+                    await socket.send(json.dumps(dict(type='update', action=action, expected=message['expected'])))
+
+
+def quantile(values, level):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(level * len(values)))] if values else None
+
+
+# latency and drift of the periods of the groups (pairs of clients).
+# the drift of a period is its length minus mseconds_per_period, the total drift of a group is how far its last
+# message is behind the rhythm of the first one
+def summarize(clients, groups, seconds):
+    latency = []
+    drift = []
+    total_drift = []
+    for first, second in groups:
+        for period, received in first.received.items():
+            if period in first.sent and period in second.sent:
+                latency.append(min(received, second.received.get(period, received)) - max(first.sent[period], second.sent[period]))
+            elif period in first.scheduled:
+                latency.append(received - first.scheduled[period])
+            if period - 1 in first.received:
+                drift.append(received - first.received[period - 1] - first.period_length)
+        last = max(first.received)
+        total_drift.append(first.received[last] - first.received[0] - last * first.period_length)
+    messages = sum(c.messages for c in clients)
+    return dict(
+        groups=len(groups),
+        participants=len(clients),
+        seconds=seconds,
+        messages=messages,
+        messages_per_second=messages / seconds,
+        latency_p50=quantile(latency, 0.5),
+        latency_p95=quantile(latency, 0.95),
+        latency_max=max(latency) if latency else None,
+        drift_mean=sum(drift) / len(drift) if drift else None,
+        drift_p95=quantile(drift, 0.95),
+        drift_max=max(drift) if drift else None,
+        total_drift_max=max(total_drift) if total_drift else None,
+    )
+
+
+async def run_session(server, session_config, num_groups, scheduler, max_periods, config_fields):
+    code, participant_codes = create_session(server, session_config, 2 * num_groups,
+                                             dict(config_fields, period_scheduler=scheduler))
+    # one thread per participant, the wait pages only open once every participant has arrived
+    with concurrent.futures.ThreadPoolExecutor(len(participant_codes)) as executor:
+        pages = list(executor.map(lambda p: advance_to_decision(server, p), participant_codes))
+    clients = [Client(server, html, scheduler, max_periods) for html in pages]
+    # the page does not show the group, partners are found by their confidences: player 1's confidence is player 2's
+    # partner_confidence and the other way round (the confidences are drawn with continuous noise)
+    by_confidence = {(c.js_vars['confidence'], c.js_vars['partner_confidence']): c for c in clients}
+    groups = [(c, by_confidence[(c.js_vars['partner_confidence'], c.js_vars['confidence'])])
+              for c in clients if c.id_in_group == 1]
+    start = time.time()
+    await asyncio.gather(*[c.play() for c in clients])
+    result = summarize(clients, groups, time.time() - start)
+    return dict(result, session=code, scheduler=scheduler, server=server)
+
+
+# python lab_loadtest.py --server http://localhost:8000 --groups 1 4 16 64 --output load.jsonl
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='load test of the live Decision page of evolving_managers')
+    parser.add_argument('--server', default='http://localhost:8000')
+    parser.add_argument('--session-config', default='evolving_managers_demo')
+    parser.add_argument('--treatment-file', help='overrides the treatment file of the session config')
+    parser.add_argument('--groups', type=int, nargs='*', default=GROUPS)
+    parser.add_argument('--scheduler', choices=('client', 'server'), default='client')
+    parser.add_argument('--max-periods', type=int, default=10**9, help='stop after this many periods')
+    parser.add_argument('--output', help='append the results to this file instead of printing them')
+    args = parser.parse_args()
+
+    config_fields = dict(treatment_file=args.treatment_file) if args.treatment_file else {}
+    output = open(args.output, 'a') if args.output else sys.stdout
+    for num_groups in args.groups:
+        result = asyncio.run(run_session(args.server, args.session_config, num_groups, args.scheduler,
+                                         args.max_periods, config_fields))
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+        print(f'{num_groups} groups: {result["messages_per_second"]:.1f} messages/s, latency p95 {result["latency_p95"]} ms, '
+              f'drift p95 {result["drift_p95"]} ms', file=sys.stderr)
+    if args.output:
+        output.close()
@@ -0,0 +1,184 @@
+import csv
+import functools
+import os
+import random
+import types
+
+
+# parts of the lab protocol (evolving_managers) that are shared with the offline tools (evolv_lab etc.).
+# only the standard library is used here, so the oTree app can import it and the tools can import it without oTree.
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evolving_managers', 'config')
+
+# column types of the treatment files, other columns (e.g. the treatment's name) are kept as strings
+INT_FIELDS = ('treatment_id', 'start_supergame', 'end_supergame', 'num_periods', 'population_size',
+              'mseconds_per_period', 'max_adjustment')
+FLOAT_FIELDS = ('gamma', 'initial_confidence_lower', 'initial_confidence_upper')
+BOOL_FIELDS = ('joint_payoff_info', 'relative_payoff_info')
+
+# parameters of the evolution of the confidences (evolving_managers C), the offline tools take them from here
+NOISE_RANGE = 0.3 # support for noise when imitating, ~U[-NOISE_RANGE/2,NOISE_RANGE/2]
+MIN_CONFIDENCE = 0.5
+MAX_CONFIDENCE = 2.0
+
+
+# a treatment file is a path or the name of a file in evolving_managers/config
+def treatment_path(treatment_file):
+    return treatment_file if os.path.exists(treatment_file) else os.path.join(CONFIG_DIR, treatment_file)
+
+
+# rows of a treatment file, converted to their types
+def read_treatment_file(treatment_file):
+    with open(treatment_path(treatment_file), newline='') as csvfile:
+        configs = [row for row in csv.DictReader(csvfile)]
+    for row in configs:
+        missing = [field for field in INT_FIELDS + FLOAT_FIELDS + BOOL_FIELDS if field not in row]
+        if missing:
+            raise ValueError(f'{treatment_file}: missing columns {missing}')
+        for field in INT_FIELDS:
+            row[field] = int(row[field])
+        for field in FLOAT_FIELDS:
+            row[field] = float(row[field])
+        for field in BOOL_FIELDS:
+            row[field] = row[field] == 'True'
+    return configs
+
+
+# the treatment of every supergame, parsed and validated once.
+# schedule[round_number] is the (read only) config of that supergame, schedule.configs are all configs in order
+class TreatmentSchedule:
+    def __init__(self, configs, name=''):
+        configs = sorted(configs, key=lambda config: config['start_supergame'])
+        expected_start = 1
+        for config in configs:
+            if config['start_supergame'] != expected_start or config['end_supergame'] < config['start_supergame']:
+                raise ValueError(f'{name}: the treatments have to cover the supergames 1, 2, ... without gaps or overlaps')
+            if config['population_size'] < 2 or config['population_size'] % 2:
+                raise ValueError(f'{name}: population_size has to be even')
+            if config['num_periods'] < 1:
+                raise ValueError(f'{name}: num_periods has to be positive')
+            expected_start = config['end_supergame'] + 1
+        if not configs:
+            raise ValueError(f'{name}: no treatments')
+        self.name = name
+        self.configs = tuple(types.MappingProxyType(dict(config)) for config in configs)
+        self.num_rounds = expected_start - 1
+        by_round = [None]
+        for config in self.configs:
+            by_round += [config] * (config['end_supergame'] - config['start_supergame'] + 1)
+        self._by_round = tuple(by_round)
+
+    def __getitem__(self, round_number):
+        if not 1 <= round_number <= self.num_rounds:
+            raise IndexError(f'{self.name}: no treatment for supergame {round_number}')
+        return self._by_round[round_number]
+
+
+# schedule of a treatment file for the offline tools, parsed again when the file changes. the app parses the file
+# once when a session is created and keeps the configs in the session (see creating_session), so an edited file
+# only affects new sessions and all processes serve a session the same schedule
+def load_schedule(treatment_file):
+    path = treatment_path(treatment_file)
+    return parse_schedule(path, os.stat(path).st_mtime_ns, treatment_file)
+
+
+@functools.lru_cache(maxsize=32)
+def parse_schedule(path, mtime, name):
+    return TreatmentSchedule(read_treatment_file(path), name)
+
+
+# one evolution step of a population at the end of a supergame (update_confidence), for the lists of the
+# firms' fitness and their managers' confidence. the result holds one list per player field:
+#   rank                   number of firms with a higher fitness, ties are ordered at random (0 is the fittest firm)
+#   prob_selection         rank / (population size - 1), a firm selects its manager out if rng.random() <= prob_selection
+#   weight                 max(0, fitness - average fitness), all 1 if no firm is above average
+#   prob_imitation_target  weight / sum of weights
+#   imitation_target       index of the imitated firm if the firm selected, else None
+#   next_confidence        the imitated manager's confidence plus U(-noise_range/2, noise_range/2) noise, clamped
+#                          to [min_confidence, max_confidence], or the own confidence if the firm did not select
+# ranks come from one sort and the targets of all selecting firms from one weighted draw, O(n log n) in total
+def evolve_population(fitness, confidence, noise_range, min_confidence, max_confidence, rng=random):
+    size = len(fitness)
+    tiebreaker = [rng.random() for _ in range(size)]
+    rank = [0] * size
+    for r, i in enumerate(sorted(range(size), key=lambda i: (-fitness[i], tiebreaker[i]))):
+        rank[i] = r
+    prob_selection = [r / (size - 1) for r in rank]
+
+    average = sum(fitness) / size
+    weight = [max(0, f - average) for f in fitness]
+    if all(w == 0 for w in weight):
+        weight = [1] * size
+    weightsum = sum(weight)
+    prob_imitation_target = [w / weightsum for w in weight]
+
+    selected = [rng.random() <= prob for prob in prob_selection]
+    targets = iter(rng.choices(range(size), weight, k=sum(selected)))
+    imitation_target = [next(targets) if s else None for s in selected]
+    next_confidence = list(confidence)
+    for i, target in enumerate(imitation_target):
+        if target is not None:
+            noisy = confidence[target] + rng.uniform(-noise_range/2, noise_range/2)
+            next_confidence[i] = min(max_confidence, max(min_confidence, noisy))
+    return dict(
+        rank=rank,
+        prob_selection=prob_selection,
+        weight=weight,
+        prob_imitation_target=prob_imitation_target,
+        selected=selected,
+        imitation_target=imitation_target,
+        next_confidence=next_confidence,
+    )
+
+
+# random stream of a session for a key, e.g. (round_number, population, 'evolution'), like evolv_random.generator for
+# the offline tools. the same seed and key always give the same draws (random.Random hashes string seeds with sha512),
+# independent of the order in which the streams are used, so lab_replay.py can redo any step of a recorded session
+def keyed_random(seed, *key):
+    return random.Random('/'.join(str(part) for part in (seed,) + key))
+
+
+# initial confidence of a population at the start of a treatment, the populations alternate between lower and upper
+def population_confidence(config, population):
+    if population % 2 == config['treatment_id'] % 2:
+        return config['initial_confidence_lower']
+    return config['initial_confidence_upper']
+
+
+# live messages of the Decision page (period_message) are compact arrays instead of dicts:
+#   [LIVE_PROTOCOL, sequence number, index in MESSAGE_TYPES, *values of MESSAGE_FIELDS]
+# the sequence number counts the messages to both clients of a group, so a client can tell if it missed one. a message
+# to one client only (resync after a reload) repeats the number of the last one.
+# the values are only displayed, so actions and payoffs are rounded to MESSAGE_DECIMAL_PLACES and times are whole
+# milliseconds. high-frequency.js gets the types and fields through js_vars, so both ends decode the same layout
+LIVE_PROTOCOL = 1
+MESSAGE_TYPES = ('start-period', 'end-supergame')
+MESSAGE_FIELDS = ('period', 'p1_action', 'p2_action', 'p1_period_payoff', 'p2_period_payoff', 'p1_round_payoff',
+                  'p2_round_payoff', 'expected', 'next_period_length')
+MESSAGE_DECIMAL_PLACES = 4
+
+
+def encode_message(seq, type, period, p1_action, p2_action, p1_period_payoff, p2_period_payoff, p1_round_payoff,
+                   p2_round_payoff, expected, next_period_length):
+    return [LIVE_PROTOCOL, seq, MESSAGE_TYPES.index(type), period,
+            round(p1_action, MESSAGE_DECIMAL_PLACES), round(p2_action, MESSAGE_DECIMAL_PLACES),
+            round(p1_period_payoff, MESSAGE_DECIMAL_PLACES), round(p2_period_payoff, MESSAGE_DECIMAL_PLACES),
+            round(p1_round_payoff, MESSAGE_DECIMAL_PLACES), round(p2_round_payoff, MESSAGE_DECIMAL_PLACES),
+            round(expected), round(next_period_length)]
+
+
+# dict with version, seq, type and the MESSAGE_FIELDS of a message
+def decode_message(message):
+    if message[0] != LIVE_PROTOCOL:
+        raise ValueError(f'unknown live protocol version {message[0]}')
+    return dict(zip(MESSAGE_FIELDS, message[3:]), version=message[0], seq=message[1], type=MESSAGE_TYPES[message[2]])
+
+
+# routing of the live traffic when several oTree processes serve the app (see lab_router.py): the live socket url of
+# the Decision page carries the id of the player's group in ROUTE_PARAM, and all sockets of a group go to the same
+# process, which keeps the group's state (group_state.py) and period timers (scheduler.py)
+ROUTE_PARAM = 'group'
+
+
+def route_worker(route, num_workers):
+    return int(route) % num_workers
@@ -0,0 +1,252 @@
+import argparse
+import csv
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import sqlalchemy
+
+from lab_protocol import (MAX_CONFIDENCE, MIN_CONFIDENCE, NOISE_RANGE, evolve_population, keyed_random, load_schedule,
+                          population_confidence)
+
+
+# replay of a recorded session of the lab app (evolving_managers) with the subjects' recorded actions and matching
+# held fixed. payoff_function and the evolution step of update_confidence are run again offline, under the
+# recorded or overridden parameters (noise_range, confidence bounds, gamma, the evolution function), and with
+# the session's seed or other seeds. the app draws everything from streams keyed by the session's seed
+# (lab_protocol.keyed_random), so the original parameters and seed reproduce the recorded confidences, ranks,
+# selections and imitation targets exactly. other seeds are counterfactual draws, which run in parallel processes.
+# arrays have shape (rounds, participants) with participants by id_in_session, actions (rounds, participants, periods).
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
+
+PLAYERS = '''
+    SELECT pl.round_number, pt.id_in_session, pl.population, pl.id_in_group, pl.group_id, g.gamma, g.num_periods,
+           g.session_config, pl.confidence, pl.round_fitness, pl.round_payoff, pl.rank, pl.selected, pl.imitation_target
+    FROM evolving_managers_player pl
+    JOIN evolving_managers_group g ON g.id = pl.group_id
+    JOIN otree_participant pt ON pt.id = pl.participant_id
+    JOIN otree_session s ON s.id = pl.session_id
+    WHERE s.code = :code
+    ORDER BY pl.round_number, pl.id
+'''
+
+ACTIONS = '''
+    SELECT pl.round_number, pt.id_in_session, o.period, o.action
+    FROM evolving_managers_observations o
+    JOIN evolving_managers_player pl ON pl.id = o.player_id
+    JOIN otree_participant pt ON pt.id = pl.participant_id
+    JOIN otree_session s ON s.id = pl.session_id
+    WHERE s.code = :code AND o.period > 0
+    ORDER BY o.id
+'''
+
+SEED = '''
+    SELECT ss.seed FROM evolving_managers_subsession ss
+    JOIN otree_session s ON s.id = ss.session_id
+    WHERE s.code = :code AND ss.round_number = 1
+'''
+
+# results of a replay that are compared with the recording
+CHECKED = ('confidence', 'round_fitness', 'round_payoff', 'rank', 'selected', 'imitation_target')
+
+
+# what the database holds about a session. played rounds only: rounds nobody has finished are left out
+class RecordedSession:
+    def __init__(self, connection, code):
+        self.code = code
+        seed = connection.execute(sqlalchemy.text(SEED), dict(code=code)).scalar()
+        if not seed:
+            raise ValueError(f'session {code} has no seed, it was recorded before the app stored them')
+        self.seed = seed
+        rows = connection.execute(sqlalchemy.text(PLAYERS), dict(code=code)).fetchall()
+        if not rows:
+            raise ValueError(f'session {code} not found')
+        self.treatment_file = rows[0].session_config
+        rounds = sorted({row.round_number for row in rows if row.rank is not None})
+        self.rounds = len(rounds)
+        if not self.rounds:
+            raise ValueError(f'session {code} has no finished supergame')
+        self.participants = max(row.id_in_session for row in rows)
+        shape = (self.rounds, self.participants)
+        self.population = np.zeros(shape, dtype=int)
+        self.partner = np.zeros(shape, dtype=int)
+        self.gamma = np.zeros(self.rounds)
+        self.num_periods = np.zeros(self.rounds, dtype=int)
+        self.order = [[] for _ in range(self.rounds)] # participants in the order of subsession.get_players()
+        self.confidence = np.zeros(shape)
+        self.round_fitness = np.zeros(shape)
+        self.round_payoff = np.zeros(shape)
+        self.rank = np.zeros(shape, dtype=int)
+        self.selected = np.zeros(shape, dtype=bool)
+        self.imitation_target = np.zeros(shape, dtype=int) # id_in_session of the imitated firm, 0 if none
+        groups = {}
+        for row in rows:
+            if row.round_number > self.rounds:
+                continue
+            r, k = row.round_number - 1, row.id_in_session - 1
+            self.order[r].append(k)
+            self.population[r, k] = row.population
+            self.gamma[r] = row.gamma
+            self.num_periods[r] = row.num_periods
+            self.confidence[r, k] = row.confidence
+            self.round_fitness[r, k] = row.round_fitness
+            self.round_payoff[r, k] = row.round_payoff
+            self.rank[r, k] = row.rank
+            self.selected[r, k] = row.selected
+            self.imitation_target[r, k] = row.imitation_target or 0
+            groups.setdefault(row.group_id, {})[row.id_in_group] = k
+        for row in rows:
+            if row.round_number <= self.rounds:
+                members = groups[row.group_id]
+                self.partner[row.round_number - 1, row.id_in_session - 1] = members[3 - row.id_in_group]
+        self.actions = np.full((self.rounds, self.participants, max(self.num_periods)), np.nan)
+        for row in connection.execute(sqlalchemy.text(ACTIONS), dict(code=code)):
+            if row.round_number <= self.rounds:
+                self.actions[row.round_number - 1, row.id_in_session - 1, row.period - 1] = row.action
+
+
+# results of a replay, like the recording
+class Replay:
+    def __init__(self, seed, rounds, participants):
+        self.seed = seed
+        shape = (rounds, participants)
+        self.confidence = np.zeros(shape)
+        self.round_fitness = np.zeros(shape)
+        self.round_payoff = np.zeros(shape)
+        self.rank = np.zeros(shape, dtype=int)
+        self.selected = np.zeros(shape, dtype=bool)
+        self.imitation_target = np.zeros(shape, dtype=int)
+
+
+# payoff_function of the app for all players and periods of a round, summed over the periods in their order like
+# round_fitness and round_payoff. returns (round_fitness, round_payoff)
+def round_payoffs(action, partner_action, confidence, gamma):
+    fitness = action * (1 - action - partner_action * gamma) * 100
+    payoff = action * np.maximum(0, confidence[:, None] - action - partner_action * gamma) * 100
+    return np.cumsum(fitness, axis=1)[:, -1], np.cumsum(payoff, axis=1)[:, -1]
+
+
+# evolve is the evolution step, called like lab_protocol.evolve_population. seed defaults to the session's
+def replay(session, noise_range=NOISE_RANGE, min_confidence=MIN_CONFIDENCE, max_confidence=MAX_CONFIDENCE, gamma=None,
+           evolve=evolve_population, seed=None):
+    seed = session.seed if seed is None else seed
+    schedule = load_schedule(session.treatment_file)
+    result = Replay(seed, session.rounds, session.participants)
+    next_confidence = None
+    for r in range(session.rounds):
+        round_number = r + 1
+        config = schedule[round_number]
+        populations = {}
+        for k in session.order[r]:
+            populations.setdefault(session.population[r, k], []).append(k)
+
+        # creating_session: initial confidences at the start of a treatment, else the evolved ones
+        if round_number == config['start_supergame']:
+            for i, members in populations.items():
+                rng = keyed_random(seed, round_number, i, 'confidence')
+                base = population_confidence(config, i)
+                for k in members:
+                    result.confidence[r, k] = base + rng.uniform(-noise_range/2, noise_range/2)
+        else:
+            result.confidence[r] = next_confidence
+
+        # the periods, with the recorded actions
+        n = session.num_periods[r]
+        action = session.actions[r, :, :n]
+        fitness, payoff = round_payoffs(action, action[session.partner[r]], result.confidence[r],
+                                        session.gamma[r] if gamma is None else gamma)
+        result.round_fitness[r] = fitness
+        result.round_payoff[r] = payoff
+
+        # update_confidence
+        next_confidence = result.confidence[r].copy()
+        for i, members in populations.items():
+            evolution = evolve([float(fitness[k]) for k in members], [float(result.confidence[r, k]) for k in members],
+                               noise_range, min_confidence, max_confidence, keyed_random(seed, round_number, i, 'evolution'))
+            for j, k in enumerate(members):
+                result.rank[r, k] = evolution['rank'][j]
+                result.selected[r, k] = evolution['selected'][j]
+                if evolution['selected'][j]:
+                    result.imitation_target[r, k] = members[evolution['imitation_target'][j]] + 1
+                if round_number != config['end_supergame']:
+                    next_confidence[k] = evolution['next_confidence'][j]
+    return result
+
+
+# names of the results that differ from the recording, empty if the replay reproduces it
+def differences(session, result):
+    return [name for name in CHECKED if not np.array_equal(getattr(session, name), getattr(result, name))]
+
+
+# seeds of counterfactual draws, keyed by the session's seed like its own streams
+def draw_seeds(session, draws):
+    return [f'{session.seed}/draw/{d}' for d in range(draws)]
+
+
+def replay_draws(session, seeds, workers=None, **parameters):
+    if workers == 1:
+        return [replay(session, seed=seed, **parameters) for seed in seeds]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(replay, session, seed=seed, **parameters) for seed in seeds]
+        return [future.result() for future in futures]
+
+
+# evolution function given as module:function, e.g. lab_protocol:evolve_population
+def load_function(name):
+    module, function = name.split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def write_rows(path, session, results):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['session.code', 'seed', 'subsession.round_number', 'participant.id_in_session', 'player.population',
+                         'player.confidence', 'player.round_fitness', 'player.round_payoff', 'player.rank',
+                         'player.selected', 'player.imitation_target'])
+        for result in results:
+            for r in range(session.rounds):
+                for k in range(session.participants):
+                    writer.writerow([session.code, result.seed, r + 1, k + 1, session.population[r, k],
+                                     result.confidence[r, k], result.round_fitness[r, k], result.round_payoff[r, k],
+                                     result.rank[r, k], int(result.selected[r, k]), result.imitation_target[r, k] or ''])
+
+
+# python lab_replay.py abcd1234 --check
+# python lab_replay.py abcd1234 --noise-range 0.1 --draws 100 --output replay.csv
+# the database is taken from DATABASE_URL like in oTree (db.sqlite3 in the current directory if it is not set)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='replay a recorded session of evolving_managers')
+    parser.add_argument('session', help='session code')
+    parser.add_argument('--check', action='store_true', help='replay with the original parameters and seed and compare')
+    parser.add_argument('--noise-range', type=float, default=NOISE_RANGE)
+    parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE)
+    parser.add_argument('--max-confidence', type=float, default=MAX_CONFIDENCE)
+    parser.add_argument('--gamma', type=float, help='overrides the recorded gamma of every supergame')
+    parser.add_argument('--evolve', default='lab_protocol:evolve_population', help='evolution step as module:function')
+    parser.add_argument('--draws', type=int, default=0, help='counterfactual draws with new seeds, 0: the session\'s seed')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument('--output', default='replay.csv')
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(args.database_url)
+    with engine.connect() as connection:
+        session = RecordedSession(connection, args.session)
+    engine.dispose()
+
+    start = time.time()
+    if args.check:
+        different = differences(session, replay(session))
+        print(f'{session.rounds} supergames replayed in {time.time() - start:.2f} s: ' +
+              ('differs in ' + ', '.join(different) if different else 'reproduced exactly'))
+        sys.exit(1 if different else 0)
+    parameters = dict(noise_range=args.noise_range, min_confidence=args.min_confidence, max_confidence=args.max_confidence,
+                      gamma=args.gamma, evolve=load_function(args.evolve))
+    seeds = draw_seeds(session, args.draws) if args.draws else [session.seed]
+    results = replay_draws(session, seeds, args.workers, **parameters)
+    write_rows(args.output, session, results)
+    print(f'{len(results)} replays of {session.rounds} supergames in {time.time() - start:.2f} s')
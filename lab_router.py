@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import urllib.parse
+
+from lab_protocol import ROUTE_PARAM, route_worker
+
+
+# runs the app on several oTree processes behind one port. oTree 5 keeps a lot in the process that serves a request:
+# the lock of the live and page requests, the wait pages' websockets, and in this app the group states and period
+# timers. so the router splits the traffic like this
+#   - the live sockets of the Decision page carry their group (see Decision.live_url) and go to process
+#     route_worker(group, workers), so all live messages of a group are handled by one process
+#   - everything else (pages, wait pages, admin, REST api) goes to the first process
+# the live messages are most of the load, so a session with several hundred participants is spread over the
+# processes. the processes share the database, use postgres (DATABASE_URL) for anything but local tests.
+# without DATABASE_URL (SQLite) the router starts one process unless --workers says otherwise, and warns if it does.
+#
+# consistency: the state of a group lives in the process that serves its live messages, the pages are rendered
+# by the first process from the database. this works because the group process writes the state back at the end of
+# every period (see group_state.py) and writes the players, observations and timings of the supergame when it ends
+# (finish_supergame), committed as soon as the message is handled. the page after the Decision page is only requested
+# once the client has received the end of the supergame, so it reads what the group's process has written. while a
+# supergame runs, the database can be one period and up to OBSERVATION_BUFFER_SIZE observations behind the group. the only exception is the admin report, which shows the timing of running
+# supergames for the groups of the first process only.
+# the router looks at the first line of a connection only and then passes the bytes through, browsers open a
+# connection of its own for every websocket.
+#
+#   python lab_router.py --port 8000 --workers 4
+#
+# starts `otree prodserver1of2` on the ports 8001..8004 (--worker-port) and listens on 8000.
+
+REQUEST_LINE_LIMIT = 65536
+
+
+def worker_for(request_line, num_workers):
+    parts = request_line.split(b' ')
+    if len(parts) < 2:
+        return 0
+    url = urllib.parse.urlsplit(parts[1].decode('latin-1'))
+    if url.path != '/live':
+        return 0
+    route = urllib.parse.parse_qs(url.query).get(ROUTE_PARAM)
+    if not route or not route[0].isdigit():
+        return 0
+    return route_worker(route[0], num_workers)
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+class Router:
+    def __init__(self, worker_ports):
+        self.worker_ports = worker_ports
+
+    async def handle(self, client_reader, client_writer):
+        try:
+            request_line = await client_reader.readuntil(b'\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            client_writer.close()
+            return
+        worker = worker_for(request_line, len(self.worker_ports))
+        try:
+            worker_reader, worker_writer = await asyncio.open_connection('127.0.0.1', self.worker_ports[worker])
+        except OSError:
+            client_writer.close()
+            return
+        worker_writer.write(request_line)
+        await asyncio.gather(pipe(client_reader, worker_writer), pipe(worker_reader, client_writer))
+
+
+# in a process group of its own, with the timeout subprocess that prodserver1of2 starts
+def start_worker(port):
+    return subprocess.Popen(['otree', 'prodserver1of2', f'127.0.0.1:{port}'], env=os.environ.copy(),
+                            start_new_session=True)
+
+
+def stop_worker(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+async def wait_for_port(port, process, timeout=60):
+    for _ in range(timeout * 10):
+        if process.poll() is not None:
+            raise RuntimeError(f'the oTree process on port {port} exited with {process.returncode}')
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f'the oTree process on port {port} did not start')
+
+
+async def serve(host, port, worker_ports):
+    processes = []
+    try:
+        # the first process creates the tables of a new database, so it starts alone
+        processes.append(start_worker(worker_ports[0]))
+        await wait_for_port(worker_ports[0], processes[0])
+        processes += [start_worker(p) for p in worker_ports[1:]]
+        await asyncio.gather(*[wait_for_port(p, w) for p, w in zip(worker_ports[1:], processes[1:])])
+        router = Router(worker_ports)
+        server = await asyncio.start_server(router.handle, host, port, limit=REQUEST_LINE_LIMIT)
+        print(f'lab_router on {host}:{port}, {len(worker_ports)} oTree processes on ports {worker_ports}', file=sys.stderr)
+        stop = asyncio.get_running_loop().create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+        async with server:
+            await stop
+    finally:
+        for process in processes:
+            stop_worker(process)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='serve evolving_managers from several oTree processes')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', 4 if os.getenv('DATABASE_URL') else 1)),
+                        help='number of oTree processes, default 4 with DATABASE_URL and 1 with SQLite')
+    parser.add_argument('--worker-port', type=int, help='port of the first oTree process, default: --port + 1')
+    args = parser.parse_args()
+
+    if args.workers > 1 and not os.getenv('DATABASE_URL'):
+        print(f'warning: {args.workers} oTree processes share SQLite (DATABASE_URL is not set), use postgres for sessions in the lab',
+              file=sys.stderr)
+    first_port = args.worker_port or args.port + 1
+    asyncio.run(serve(args.host, args.port, [first_port + i for i in range(args.workers)]))
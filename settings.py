@@ -59,16 +59,23 @@ ROOMS = [
 # e.g. self.session.config['participation_fee']
 
 SESSION_CONFIG_DEFAULTS = dict(
-    real_world_currency_per_point=1.00, participation_fee=0.00, doc=""
+    real_world_currency_per_point=1.00, participation_fee=0.00, doc="",
+    period_scheduler='client', # 'client': a period ends when both browsers have replied, 'server': the server ends periods on its own clock
+    fast_forward=False, # with simulation = True: play all supergames on the server when the session is created, without browsers or timers
+    seed='', # seed of the session's random draws, a new one if empty. sessions with the same seed and participants draw the same
 )
 
 PARTICIPANT_FIELDS = [
      'confidence',
      'population',
      'total_payoff',
-     'configs'
 ]
-SESSION_FIELDS = []
+SESSION_FIELDS = [
+     'seed',
+     'treatment_configs',
+     'populations',
+     'initial_population_confidence',
+]
 
 # ISO-639 code
 # for example: de, fr, ja, ko, zh-hans
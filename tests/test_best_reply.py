@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from evolv_best_reply import action_grid, best_reply, grid_best_reply, grid_payoffs, manager_payoff
+
+
+def random_cases(rng, cases, others):
+    gamma = rng.uniform(0, 1.5, cases)[:, None]
+    a = rng.uniform(0.3, 2.0, cases)
+    other_qs = rng.uniform(0, 1, (cases, others))
+    return gamma, a, other_qs
+
+
+# the closed form on a grid picks the same grid point as a scan over the whole grid
+@pytest.mark.parametrize('others', [1, 2, 3, 5])
+@pytest.mark.parametrize('decimal_places', [2, 3])
+def test_grid_best_reply_matches_scan(others, decimal_places):
+    rng = np.random.default_rng(others * 10 + decimal_places)
+    gamma, a, other_qs = random_cases(rng, 1000, others)
+    expected = np.array([grid_best_reply(gamma[i, 0], 1, a[i], other_qs[i], decimal_places) for i in range(len(a))])
+    result = np.array([best_reply(gamma[i, 0], 1, a[i], other_qs[i], decimal_places) for i in range(len(a))])
+    assert np.array_equal(result, expected)
+
+
+# the exact best reply is at least as good as every grid point and as the finest grid
+@pytest.mark.parametrize('others', [1, 3])
+def test_exact_best_reply_beats_grid(others):
+    rng = np.random.default_rng(others)
+    gamma, a, other_qs = random_cases(rng, 500, others)
+    for i in range(len(a)):
+        exact = best_reply(gamma[i, 0], 1, a[i], other_qs[i])
+        assert 0 <= exact <= 1
+        best_on_grid = grid_payoffs(gamma[i, 0], 1, a[i], other_qs[i], 4).max()
+        assert manager_payoff(gamma[i, 0], 1, a[i], exact, other_qs[i]) >= best_on_grid - 1e-12
+
+
+# batched calls give the same result as one call per player
+def test_best_reply_batched():
+    rng = np.random.default_rng(0)
+    a = rng.uniform(0.5, 1.5, (20, 4))
+    other_qs = rng.uniform(0, 1, (20, 4, 3))
+    batched = best_reply(0.5, 1, a, other_qs, 3)
+    single = np.array([[best_reply(0.5, 1, a[m, j], other_qs[m, j], 3) for j in range(4)] for m in range(20)])
+    assert np.array_equal(batched, single)
+    assert np.isin(batched, action_grid(3)).all()
@@ -0,0 +1,41 @@
+import numpy as np
+
+from evolv_random import MARKET_BLOCK, MarketStreams, generator
+from evolv_simu import Simulation, mimic_choice
+
+
+def test_generator_is_keyed():
+    assert np.array_equal(generator(1, 2, 3).random(5), generator(1, 2, 3).random(5))
+    assert not np.array_equal(generator(1, 2, 3).random(5), generator(1, 3, 2).random(5))
+
+
+# a market draws the same numbers in every chunk that contains it, also across block boundaries
+def test_market_streams_chunks():
+    markets = 3 * MARKET_BLOCK + 17
+    full = MarketStreams(7, range(markets))
+    chunks = [MarketStreams(7, range(start, stop)) for start, stop in
+              ((0, 100), (100, MARKET_BLOCK + 5), (MARKET_BLOCK + 5, 2 * MARKET_BLOCK), (2 * MARKET_BLOCK, markets))]
+    for draw in (lambda rng, m: rng.random((m, 4)), lambda rng, m: rng.uniform(-1, 1, (m, 4)),
+                 lambda rng, m: rng.normal(0, 1, (m, 2, 3))):
+        expected = draw(full, markets)
+        assert expected.shape[0] == markets
+        assert np.array_equal(expected, np.concatenate([draw(c, c.markets) for c in chunks]))
+
+
+def test_simulation_chunks():
+    parameters = dict(n=4, t=20, seed=11, rng_streams='market', evo_mech='weighted_average', choice_func=mimic_choice)
+    full = Simulation(dict(parameters, m=600))
+    full.run_simulation()
+    chunks = [Simulation(dict(parameters, m=m, first_market=first)) for first, m in ((0, 250), (250, 213), (463, 137))]
+    for chunk in chunks:
+        chunk.run_simulation()
+    for series in ('q_history', 'a_history', 'p_manager_history', 'p_firm_history'):
+        assert np.array_equal(getattr(full, series), np.concatenate([getattr(c, series) for c in chunks]))
+
+
+def test_simulation_seed():
+    parameters = dict(n=2, t=20, m=30, seed=3)
+    runs = [Simulation(dict(parameters)) for _ in range(2)]
+    for run in runs:
+        run.run_simulation()
+    assert np.array_equal(runs[0].q_history, runs[1].q_history)
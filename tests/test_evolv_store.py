@@ -0,0 +1,24 @@
+import functools
+
+import numpy as np
+
+from evolv_simu import Simulation, best_choice_slow, normal_noise
+from evolv_store import open_run
+
+
+def test_stored_run(tmp_path):
+    parameters = dict(n=2, t=12, m=5, evolution_every_x_rounds=3, noise_func=normal_noise,
+                      choice_func=functools.partial(best_choice_slow, decimal_places=3))
+    simulation = Simulation(dict(parameters, output=str(tmp_path / 'run')))
+    simulation.run_simulation()
+
+    run = open_run(str(tmp_path / 'run'))
+    assert run.t == 12
+    assert np.array_equal(run.a_history, simulation.a_history)
+
+    rerun = Simulation(run.parameters_for_rerun())
+    assert rerun.output is None
+    assert rerun.choice_func.keywords == dict(decimal_places=3)
+    rerun.run_simulation()
+    for series in ('q_history', 'a_history', 'p_manager_history', 'p_firm_history'):
+        assert np.array_equal(getattr(rerun, series), getattr(simulation, series))
@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from lab_protocol import LIVE_PROTOCOL, MESSAGE_DECIMAL_PLACES, MESSAGE_FIELDS, MESSAGE_TYPES, decode_message, encode_message
+
+
+def test_message_round_trip():
+    values = dict(period=7, p1_action=0.123456, p2_action=0.5, p1_period_payoff=12.345678, p2_period_payoff=0.0,
+                  p1_round_payoff=100.987654, p2_round_payoff=-3.25, expected=1700000000123.6, next_period_length=1987.4)
+    for seq, type in enumerate(MESSAGE_TYPES, 1):
+        message = encode_message(seq, type, **values)
+        assert message[:3] == [LIVE_PROTOCOL, seq, MESSAGE_TYPES.index(type)]
+        assert len(message) == 3 + len(MESSAGE_FIELDS)
+        decoded = decode_message(json.loads(json.dumps(message))) # like over the websocket
+        assert decoded['type'] == type and decoded['seq'] == seq and decoded['version'] == LIVE_PROTOCOL
+        for field in MESSAGE_FIELDS:
+            if field in ('expected', 'next_period_length'):
+                assert decoded[field] == round(values[field])
+            else:
+                assert decoded[field] == pytest.approx(values[field], abs=10**-MESSAGE_DECIMAL_PLACES)
+
+
+def test_message_version():
+    message = encode_message(1, 'start-period', 0, 0.5, 0.5, 1, 1, 1, 1, 0, 2000)
+    message[0] = LIVE_PROTOCOL + 1
+    with pytest.raises(ValueError):
+        decode_message(message)
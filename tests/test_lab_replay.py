@@ -0,0 +1,79 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import sqlalchemy
+
+from lab_protocol import keyed_random
+from lab_replay import RecordedSession, differences, draw_seeds, replay, replay_draws
+
+# a session of 8 participants in 2 populations and 3 supergames over two treatments (a reset of the confidences in
+# supergame 3), played by evolving_managers with simulation and fast_forward. the tables hold the columns that
+# lab_replay reads, the treatment file is the one the session was created with
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'replay_session.json')
+
+
+def load_fixture(path, unfinished=False):
+    with open(FIXTURE) as fixture_file:
+        fixture = json.load(fixture_file)
+    treatment_file = str(path / 'treatment.csv')
+    with open(treatment_file, 'w') as csvfile:
+        csvfile.write(fixture['treatment_file'])
+    engine = sqlalchemy.create_engine(f'sqlite:///{path / "db.sqlite3"}')
+    with engine.begin() as connection:
+        for name, table in fixture['tables'].items():
+            columns = table['columns']
+            connection.execute(sqlalchemy.text(f'CREATE TABLE {name} ({", ".join(columns)})'))
+            rows = [dict(zip(columns, row)) for row in table['rows']]
+            if name == 'evolving_managers_group':
+                for row in rows:
+                    row['session_config'] = treatment_file
+            if name == 'evolving_managers_player' and unfinished:
+                for row in rows:
+                    row['rank'] = None
+            connection.execute(sqlalchemy.text(
+                f'INSERT INTO {name} VALUES ({", ".join(":" + column for column in columns)})'), rows)
+    try:
+        with engine.connect() as connection:
+            return RecordedSession(connection, fixture['session'])
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def recorded(tmp_path_factory):
+    return load_fixture(tmp_path_factory.mktemp('replay'))
+
+
+def test_replay_reproduces_recording(recorded):
+    assert recorded.rounds == 3
+    assert differences(recorded, replay(recorded)) == []
+
+
+# a session stopped before the first supergame was over
+def test_unfinished_session(tmp_path):
+    with pytest.raises(ValueError, match='no finished supergame'):
+        load_fixture(tmp_path, unfinished=True)
+
+
+def test_replay_parameters_change_results(recorded):
+    assert 'round_fitness' in differences(recorded, replay(recorded, gamma=0.2))
+    assert 'confidence' in differences(recorded, replay(recorded, noise_range=0.1))
+    assert differences(recorded, replay(recorded, seed=draw_seeds(recorded, 1)[0]))
+
+
+def test_replay_draws(recorded):
+    seeds = draw_seeds(recorded, 3)
+    assert len(set(seeds)) == 3
+    serial = replay_draws(recorded, seeds, workers=1, noise_range=0.1)
+    parallel = replay_draws(recorded, seeds, workers=2, noise_range=0.1)
+    for a, b in zip(serial, parallel):
+        assert a.seed == b.seed
+        assert np.array_equal(a.confidence, b.confidence)
+        assert np.array_equal(a.imitation_target, b.imitation_target)
+
+
+def test_keyed_random():
+    assert keyed_random('s', 1, 2, 'evolution').random() == keyed_random('s', 1, 2, 'evolution').random()
+    assert keyed_random('s', 1, 2, 'evolution').random() != keyed_random('s', 1, 2, 'matching').random()